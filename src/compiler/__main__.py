@@ -9,15 +9,16 @@ from tokenizer import tokenize
 from parser import parse
 from ir_generator import generate_ir, GLOBAL_SYMTAB
 from assembler import assemble_and_get_executable
-from assembly_generator import generate_assembly
+from assembly_generator import generate_assembly, write_assembly
+from interpreter import exec_ir
 
 
 def call_compiler(source_code: str, input_file_name: str) -> bytes:
     try:
         tokens = tokenize(source_code)
         parsed = parse(tokens)
-        ir_lines = generate_ir(GLOBAL_SYMTAB, parsed)
-        assembly_code = generate_assembly(ir_lines)
+        ir_lines, ir_vars = generate_ir(GLOBAL_SYMTAB, parsed)
+        assembly_code = generate_assembly(ir_lines, ir_vars)
         return assemble_and_get_executable(assembly_code)
     except Exception as e:
         raise Exception(f"Compilation error: {e}")
@@ -66,6 +67,17 @@ def main() -> int:
         executable = call_compiler(source_code, input_file or '(source code)')
         with open(output_file, 'wb') as f:
             f.write(executable)
+    elif command == 'assembly':
+        source_code = read_source_code()
+        if output_file is None:
+            raise Exception("Output file flag --output=... required")
+        ir_lines, ir_vars = generate_ir(GLOBAL_SYMTAB, parse(tokenize(source_code)))
+        with open(output_file, 'wb') as f:
+            write_assembly(ir_lines, ir_vars, f)
+    elif command == 'interpret':
+        source_code = read_source_code()
+        ir_lines, _ = generate_ir(GLOBAL_SYMTAB, parse(tokenize(source_code)))
+        exec_ir(ir_lines)
     elif command == 'serve':
         try:
             run_server(host, port)
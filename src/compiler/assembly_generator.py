@@ -1,65 +1,323 @@
 import ir
-import dataclasses
-from instrinsics import all_intrinsics, IntrinsicArgs
+import os
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import Any, BinaryIO, Callable, TypeAlias
+from instrinsics import IntrinsicArgs
+
+
+# Annotate the assembly with each IR instruction as a comment.
+# Off by default since printing the instructions is slow for large programs.
+DEBUG_COMMENTS = os.environ.get("COMPILER_DEBUG_COMMENTS", "") not in ("", "0")
+
+# Callee-saved in the System V ABI, so values kept in them survive calls to
+# print_int and friends without any extra saving around the call.
+_CALLEE_SAVED_REGISTERS = ("%rbx", "%r12", "%r13", "%r14", "%r15")
+# Where the System V ABI passes the first six integer arguments
+_ARGUMENT_REGISTERS = ("%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9")
+
+
+@lru_cache(maxsize=None)
+def _stack_ref(offset: int) -> str:
+    return f"{offset}(%rbp)"
+
+
+# `movq` to and from %rax makes up most of the Copy, LoadConst and Call output,
+# so the whole line is built once per location and reused afterwards.
+@lru_cache(maxsize=None)
+def _load_rax(ref: str) -> str:
+    return f"movq {ref}, %rax"
+
+
+@lru_cache(maxsize=None)
+def _store_rax(ref: str) -> str:
+    return f"movq %rax, {ref}"
+
+
+def _is_register(ref: str) -> bool:
+    return ref[0] == "%"
+
+
+def _insn_vars(insn: ir.Instruction) -> list[ir.IRVar]:
+    """Returns the local variables read or written by `insn`."""
+    match insn:
+        case ir.LoadBoolConst(dest=dest) | ir.LoadIntConst(dest=dest):
+            return [dest]
+        case ir.Copy(source=source, dest=dest):
+            return [source, dest]
+        case ir.Call(args=args, dest=dest):
+            return [*args, dest]
+        case ir.CondJump(cond=cond):
+            return [cond]
+        case _:
+            return []
+
+
+def _live_intervals(instructions: list[ir.Instruction]) -> dict[ir.IRVar, list[int]]:
+    """Returns for every variable the range `[first, last]` of instruction indices where it may be live.
+
+    The ranges are conservative: any range overlapping a loop is widened to the whole loop,
+    since a value may flow around the back edge."""
+    intervals: dict[ir.IRVar, list[int]] = {}
+    label_index: dict[str, int] = {}
+    for i, insn in enumerate(instructions):
+        if isinstance(insn, ir.Label):
+            label_index[insn.name] = i
+        for var in _insn_vars(insn):
+            interval = intervals.get(var)
+            if interval is None:
+                intervals[var] = [i, i]
+            else:
+                interval[1] = i
+
+    loops: list[tuple[int, int]] = []
+    for i, insn in enumerate(instructions):
+        match insn:
+            case ir.Jump(label=label):
+                targets = [label]
+            case ir.CondJump(then_label=then_label, else_label=else_label):
+                targets = [t for t in (then_label, else_label) if t is not None]
+            case _:
+                continue
+        for target in targets:
+            start = label_index[target.name]
+            if start <= i:
+                loops.append((start, i))
+    if not loops:
+        return intervals
+
+    # A range widened to one loop then overlaps every loop overlapping that one,
+    # so overlapping loops are merged into disjoint regions first. Each range then
+    # only needs widening to the regions it overlaps, found by binary search.
+    loops.sort()
+    region_starts: list[int] = []
+    region_ends: list[int] = []
+    for start, end in loops:
+        if region_ends and start <= region_ends[-1]:
+            region_ends[-1] = max(region_ends[-1], end)
+        else:
+            region_starts.append(start)
+            region_ends.append(end)
+
+    for interval in intervals.values():
+        first = bisect_left(region_ends, interval[0])
+        last = bisect_right(region_starts, interval[1]) - 1
+        if first <= last:
+            interval[0] = min(interval[0], region_starts[first])
+            interval[1] = max(interval[1], region_ends[last])
+    return intervals
 
 
 class Locals:
-    """Knows the memory location of every local variable."""
-    _var_to_location: dict[ir.IRVar, str]
+    """Knows the memory location of every local variable.
+
+    Variables are linear-scan allocated to the callee-saved registers,
+    preferring short live ranges; the rest get a stack slot below `%rbp`."""
+    # Indexed by `IRVar.id`; None for variables without a location
+    _refs: list[str | None]
+    _saved_registers: list[str]
     _stack_used: int
 
-    def __init__(self, variables: list[ir.IRVar]) -> None:
-        self._var_to_location = {}
-        self._stack_used = 0
-        for i, var in enumerate(variables, start=1):
-            offset = -8 * i
-            self._var_to_location[var] = f"{offset}(%rbp)"
-        self._stack_used = len(variables) * 8
+    def __init__(self, variables: list[ir.IRVar], instructions: list[ir.Instruction]) -> None:
+        intervals = _live_intervals(instructions)
+        registers: dict[ir.IRVar, str] = {}
+        free = list(reversed(_CALLEE_SAVED_REGISTERS))
+        active: list[tuple[int, ir.IRVar]] = []
+        for var in sorted((v for v in variables if v in intervals), key=lambda v: intervals[v][0]):
+            start, end = intervals[var]
+            for expired in [a for a in active if a[0] < start]:
+                active.remove(expired)
+                free.append(registers[expired[1]])
+            if free:
+                registers[var] = free.pop()
+                active.append((end, var))
+            else:
+                # Out of registers: keep the shorter of the two ranges in a register
+                furthest = max(active, key=lambda a: a[0])
+                if furthest[0] > end:
+                    registers[var] = registers.pop(furthest[1])
+                    active.remove(furthest)
+                    active.append((end, var))
+
+        self._refs = [None] * (max((var.id for var in variables), default=-1) + 1)
+        stack_slots = 0
+        for var in variables:
+            if var in registers:
+                self._refs[var.id] = registers[var]
+            elif var in intervals:
+                stack_slots += 1
+                self._refs[var.id] = _stack_ref(-8 * stack_slots)
+        used = set(registers.values())
+        self._saved_registers = [r for r in _CALLEE_SAVED_REGISTERS if r in used]
+        self._stack_used = stack_slots * 8
+        # Keep %rsp 16-byte aligned after the saved registers are pushed
+        if (self._stack_used + 8 * len(self._saved_registers)) % 16 != 0:
+            self._stack_used += 8
 
     def get_ref(self, v: ir.IRVar) -> str:
-        """Returns an Assembly reference like `-24(%rbp)`
-        for the memory location that stores the given variable"""
-        #print(self._var_to_location)
-        return self._var_to_location[v]
+        """Returns an Assembly reference like `-24(%rbp)` or `%rbx`
+        for the location that stores the given variable"""
+        ref = self._refs[v.id]
+        if ref is None:
+            raise KeyError(v)
+        return ref
+
+    def saved_registers(self) -> list[str]:
+        """Returns the callee-saved registers that must be preserved by the function."""
+        return self._saved_registers
 
     def stack_used(self) -> int:
         """Returns the number of bytes of stack space needed for the local variables."""
         return self._stack_used
 
     def __len__(self):
-        return len(self._var_to_location)
+        return len(self._refs) - self._refs.count(None)
 
 
-def get_all_ir_variables(instructions: list[ir.Instruction]) -> list[ir.IRVar]:
-    result_list: list[ir.IRVar] = []
-    result_set: set[ir.IRVar] = set()
+Emit: TypeAlias = Callable[[str], None]
+# Handlers also see the neighbouring instructions, for peephole decisions
+Neighbour: TypeAlias = ir.Instruction | None
 
-    def add(v: ir.IRVar) -> None:
-        if v not in result_set:
-            result_list.append(v)
-            result_set.add(v)
+# Conditional jump taken when the comparison intrinsic's result is true
+_FLAG_JUMPS = {"==": "je", "!=": "jne", "<": "jl", "<=": "jle", ">": "jg", ">=": "jge"}
+_INVERTED_JUMPS = {"je": "jne", "jne": "je", "jl": "jge", "jge": "jl", "jle": "jg", "jg": "jle"}
+
+# Prebuilt `movq $N, ` prefixes for the small constants that loop counters and
+# booleans mostly use, so only the destination has to be appended
+_IMM_PREFIX = {i: f"movq ${i}, " for i in range(-128, 257)}
+_TRUE_PREFIX = _IMM_PREFIX[1]
+_FALSE_PREFIX = _IMM_PREFIX[0]
+
+
+def _emit_label(insn: ir.Label, locals: Locals, emit: Emit, prev_insn: Neighbour, next_insn: Neighbour) -> None:
+    emit("")
+    emit(insn.asm_def)
+
+
+def _emit_load_int(insn: ir.LoadIntConst, locals: Locals, emit: Emit, prev_insn: Neighbour, next_insn: Neighbour) -> None:
+    prefix = _IMM_PREFIX.get(insn.value)
+    if prefix is not None:
+        emit(prefix + locals.get_ref(insn.dest))
+    elif -2**31 <= insn.value < 2**31:
+        emit(f'movq ${insn.value}, {locals.get_ref(insn.dest)}')
+    else:
+        dest = locals.get_ref(insn.dest)
+        if _is_register(dest):
+            emit(f'movabsq ${insn.value}, {dest}')
+        else:
+            emit(f'movabsq ${insn.value}, %rax')
+            emit(_store_rax(dest))
+
+
+def _emit_jump(insn: ir.Jump, locals: Locals, emit: Emit, prev_insn: Neighbour, next_insn: Neighbour) -> None:
+    # Falling through to the next label needs no jump
+    if not (isinstance(next_insn, ir.Label) and next_insn.name == insn.label.name):
+        emit(insn.label.jmp_line)
+
+
+def _emit_load_bool(insn: ir.LoadBoolConst, locals: Locals, emit: Emit, prev_insn: Neighbour, next_insn: Neighbour) -> None:
+    emit((_TRUE_PREFIX if insn.value else _FALSE_PREFIX) + locals.get_ref(insn.dest))
+
+
+def _emit_copy(insn: ir.Copy, locals: Locals, emit: Emit, prev_insn: Neighbour, next_insn: Neighbour) -> None:
+    source = locals.get_ref(insn.source)
+    dest = locals.get_ref(insn.dest)
+    if source == dest:
+        return
+    if _is_register(source) or _is_register(dest):
+        emit(f"movq {source}, {dest}")
+    else:
+        emit(_load_rax(source))
+        emit(_store_rax(dest))
+
+
+def _emit_cond_jump(insn: ir.CondJump, locals: Locals, emit: Emit, prev_insn: Neighbour, next_insn: Neighbour) -> None:
+    prev_fun = None
+    if isinstance(prev_insn, ir.Call) and prev_insn.intrinsic is not None and prev_insn.dest == insn.cond:
+        prev_fun = prev_insn.fun.name
+    if prev_fun in _FLAG_JUMPS:
+        # The comparison intrinsic has just set the flags for `cond`, and the
+        # `setcc` and `movq` after its `cmpq` leave them untouched
+        jump_if_true = _FLAG_JUMPS[prev_fun]
+    else:
+        cond = locals.get_ref(insn.cond)
+        if _is_register(cond):
+            emit(f"testq {cond}, {cond}")
+        else:
+            emit(f"cmpq $0, {cond}")
+        jump_if_true = "jne"
+    next_label = next_insn.name if isinstance(next_insn, ir.Label) else None
+    then_label = insn.then_label
+    else_label = insn.else_label
+    if then_label and else_label and then_label.name == next_label:
+        emit(f"{_INVERTED_JUMPS[jump_if_true]} {else_label.asm_ref}")
+        return
+    if then_label:
+        emit(f"{jump_if_true} {then_label.asm_ref}")
+    if else_label and else_label.name != next_label:
+        emit(else_label.jmp_line)
 
-    for insn in instructions:
-        match insn:
-            case ir.LoadBoolConst(value=value, dest=dest):
-                add(dest)
-            case ir.LoadIntConst(value=value, dest=dest):
-                add(dest)
-            case ir.Copy(source=source, dest=dest):
-                add(source)
-                add(dest)
-            case ir.Call(fun=fun, args=args, dest=dest):
-                add(dest)
-            case _:
-                continue
-    return result_list
 
+def _emit_call(insn: ir.Call, locals: Locals, emit: Emit, prev_insn: Neighbour, next_insn: Neighbour) -> None:
+    fun = insn.fun
+    arg_refs = [locals.get_ref(arg) for arg in insn.args]
+    if insn.intrinsic is not None:
+        insn.intrinsic(IntrinsicArgs(
+            arg_refs=arg_refs,
+            result_register="%rax",
+            emit=emit
+        ))
+        emit(_store_rax(locals.get_ref(insn.dest)))
+    else:
+        if len(arg_refs) == 1:
+            emit(f"movq {arg_refs[0]}, %rdi")
+        elif len(arg_refs) > len(_ARGUMENT_REGISTERS):
+            raise Exception(f"{insn.location}: calls with more than {len(_ARGUMENT_REGISTERS)} arguments are not supported")
+        else:
+            for ref, register in zip(arg_refs, _ARGUMENT_REGISTERS):
+                emit(f"movq {ref}, {register}")
+        emit(f"callq {fun.name}")
+        emit(_store_rax(locals.get_ref(insn.dest)))
 
-def generate_assembly(instructions: list[ir.Instruction]) -> str:
-    lines = []
-    def emit(line: str) -> None: lines.append(line)
+
+# Dispatching on the exact instruction class is a single dict lookup,
+# whereas a `match` statement tries every class pattern in turn.
+_HANDLERS: dict[type, Callable[[Any, Locals, Emit, Neighbour, Neighbour], None]] = {
+    ir.Label: _emit_label,
+    ir.LoadIntConst: _emit_load_int,
+    ir.Jump: _emit_jump,
+    ir.LoadBoolConst: _emit_load_bool,
+    ir.Copy: _emit_copy,
+    ir.CondJump: _emit_cond_jump,
+    ir.Call: _emit_call,
+}
+
+
+def generate_assembly(instructions: list[ir.Instruction], variables: list[ir.IRVar]) -> str:
+    """Returns the Assembly code for `instructions` as a single string"""
+    lines: list[str] = []
+    _emit_main(instructions, variables, lines.append)
+    lines.append("")
+    return "\n".join(lines)
+
+
+def write_assembly(instructions: list[ir.Instruction], variables: list[ir.IRVar], out: BinaryIO) -> None:
+    """Writes the Assembly code for `instructions` to `out` line by line,
+    without holding the whole program in memory. `out` should be buffered,
+    like the files returned by `open(..., 'wb')`."""
+    write = out.write
+
+    def emit(line: str) -> None:
+        write(line.encode())
+        write(b"\n")
+
+    _emit_main(instructions, variables, emit)
+
+
+def _emit_main(instructions: list[ir.Instruction], variables: list[ir.IRVar], emit: Emit) -> None:
     locals = Locals(
-        variables=get_all_ir_variables(instructions)
+        variables=variables,
+        instructions=instructions
     )
     emit(".extern print_int")
     emit(".extern print_bool")
@@ -70,50 +328,18 @@ def generate_assembly(instructions: list[ir.Instruction]) -> str:
     emit("main:")
     emit("pushq %rbp")
     emit("movq %rsp, %rbp")
-    emit(f"subq ${8 * len(locals)}, %rsp")
+    emit(f"subq ${locals.stack_used()}, %rsp")
+    for register in locals.saved_registers():
+        emit(f"pushq {register}")
 
-    for insn in instructions:
-        emit('# ' + str(insn))
-        match insn:
-            case ir.Label(name=name):
-                emit("")
-                emit(f'.{name}:')
-            case ir.LoadIntConst(value=value, dest=dest):
-                if -2**31 <= value < 2**31:
-                    emit(f'movq ${value}, {locals.get_ref(dest)}')
-                else:
-                    emit(f'movabsq ${value}, %rax')
-                    emit(f'movq %rax, {locals.get_ref(dest)}')
-            case ir.Jump(label=label):
-                emit(f'jmp .{label.name}')
-            case ir.LoadBoolConst(value=value, dest=dest):
-                bool_value = 1 if value else 0
-                emit(f"movq ${bool_value}, {locals.get_ref(dest)}")
-            case ir.Copy(source=source, dest=dest):
-                emit(f"movq {locals.get_ref(source)}, %rax")
-                emit(f"movq %rax, {locals.get_ref(dest)}")
-            case ir.CondJump(cond=cond, then_label=then_label, else_label=else_label):
-                emit(f"cmpq $0, {locals.get_ref(cond)}")
-                if then_label:
-                    emit(f"jne .{then_label.name}")
-                if else_label:
-                    emit(f"jmp .{else_label.name}")
-            case ir.Call(fun=fun, args=args, dest=dest):
-                arg_refs = [locals.get_ref(arg) for arg in args]
-                if str(fun) in all_intrinsics:
-                    all_intrinsics[str(fun)](IntrinsicArgs(
-                        arg_refs=arg_refs,
-                        result_register="%rax",
-                        emit=emit
-                    ))
-                    emit(f"movq %rax, {locals.get_ref(dest)}")
-                else:
-                    for i, arg in enumerate(args[:6]):
-                        emit(f"movq {arg_refs[i]}, %rdi")
-                    emit(f"callq {fun}")
-                    emit(f"movq %rax, {locals.get_ref(dest)}")
+    handlers = _HANDLERS
+    for prev_insn, insn, next_insn in zip([None, *instructions], instructions, [*instructions[1:], None]):
+        if DEBUG_COMMENTS:
+            emit('# ' + str(insn))
+        handlers[type(insn)](insn, locals, emit, prev_insn, next_insn)
     emit("movq $0, %rax")
+    for register in reversed(locals.saved_registers()):
+        emit(f"popq {register}")
     emit("movq %rbp, %rsp")
     emit("popq %rbp")
     emit("ret")
-    return "\n".join(lines)
@@ -3,24 +3,26 @@ from tokenizer import Location
 from datatypes import Type, IntType, BoolType, UnitType
 
 
-@dataclass
+@dataclass(slots=True)
 class Expression:
     """Base class for AST nodes representing expressions."""
     location: Location
     type: Type = field(kw_only=True, default=UnitType)
 
 
-@dataclass
+@dataclass(slots=True)
 class Literal(Expression):
     value: int | bool | None
 
 
-@dataclass
+@dataclass(slots=True)
 class Identifier(Expression):
     name: str
+    # Index into the interpreter's environment, set by `resolve_scopes`
+    slot: int | None = field(default=None, kw_only=True, repr=False, compare=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class BinaryOp(Expression):
     """AST node for a binary operation like `A + B`"""
     left: Expression
@@ -28,7 +30,7 @@ class BinaryOp(Expression):
     right: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class IfExpr(Expression):
     condition: Expression
     then_expr: Expression
@@ -41,41 +43,42 @@ class IfExpr(Expression):
             return f"IfExpr(condition={self.condition}, then={self.then_expr})"
 
 
-@dataclass
+@dataclass(slots=True)
 class Call(Expression):
     """AST node for functional calls like f(x, y + z)"""
     function: str
     arguments: list[Expression]
 
 
-@dataclass
+@dataclass(slots=True)
 class UnaryOp(Expression):
     """AST node for a unary operation like -A or not A"""
     op: str
     expr: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class Block(Expression):
     """AST node for a block of expressions inside {}"""
     statements: list[Expression]
     result_expr: Expression | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class VarDecl(Expression):
     """AST node for variable declarations (var x = expr)"""
     name: str
     initializer: Expression
+    slot: int | None = field(default=None, kw_only=True, repr=False, compare=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class Program(Expression):
     statements: list[Expression]
     result: Expression | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class While(Expression):
     condition: Expression
     statements: list[Expression]
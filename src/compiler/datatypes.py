@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List
+from typing import Any
 
 
 @dataclass(frozen=True)
@@ -7,36 +7,68 @@ class Type:
     """Basic type for types"""
 
 
-@dataclass(frozen=True)
+# The single instance of each type without parameters, so that types can be
+# compared with `is`
+_SINGLETONS: dict[type, Any] = {}
+
+
+def _singleton(cls: type) -> Any:
+    instance = _SINGLETONS.get(cls)
+    if instance is None:
+        instance = _SINGLETONS[cls] = object.__new__(cls)
+    return instance
+
+
+@dataclass(frozen=True, eq=False)
 class IntType(Type):
+    def __new__(cls) -> "IntType":
+        return _singleton(cls)
+
     def __repr__(self):
         return "Int"
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class BoolType(Type):
+    def __new__(cls) -> "BoolType":
+        return _singleton(cls)
+
     def __repr__(self):
         return "Bool"
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class UnitType(Type):
+    def __new__(cls) -> "UnitType":
+        return _singleton(cls)
+
     def __repr__(self):
         return "Unit"
 
 
+_FUN_TYPES: dict[tuple[tuple[Type, ...], Type], "FunType"] = {}
+
+
 @dataclass(frozen=True)
 class FunType(Type):
-    param_types: List[Type]
+    """Function types are interned, so equal signatures share one object"""
+    param_types: tuple[Type, ...]
     return_type: Type
 
+    def __new__(cls, param_types: tuple[Type, ...], return_type: Type) -> "FunType":
+        key = (param_types, return_type)
+        fun_type = _FUN_TYPES.get(key)
+        if fun_type is None:
+            fun_type = _FUN_TYPES[key] = object.__new__(cls)
+        return fun_type
+
     def __repr__(self):
         param_str = ", ".join(map(str, self.param_types))
         return f"({param_str}) -> {self.return_type}"
 
     def __eq__(self, other):
-        return (isinstance(other, FunType) and self.param_types == other.param_types
-                and self.return_type == other.return_type)
+        return self is other or (isinstance(other, FunType) and self.param_types == other.param_types
+                                 and self.return_type == other.return_type)
 
 
 Int = IntType()
@@ -1,6 +1,9 @@
-from typing import Any, Optional
+from typing import Any, Callable, Optional
+import operator
 import astree as ast
+import ir
 from parser import parser
+from ir_generator import VAR_UNIT
 from dataclasses import dataclass
 
 type Value = int | bool | ast.Call | None
@@ -31,74 +34,182 @@ class SymTab:
 GLOBAL_SYMBOLS = SymTab(locals={
     "or": lambda a, b: a or b,
     "and": lambda a, b: a and b,
-    "==": lambda a, b: a == b,
-    "!=": lambda a, b: a != b,
-    "<": lambda a, b: a < b,
-    "<=": lambda a, b: a <= b,
-    ">": lambda a, b: a > b,
-    ">=": lambda a, b: a > b,
-    "+": lambda a, b: a + b,
-    "-": lambda a, b: a - b,
-    "*": lambda a, b: a * b,
-    "/": lambda a, b: a / b,
-    "%": lambda a, b: a % b,
-    "not": lambda a: not a,
-    "unary_neg": lambda a: -a,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "%": operator.mod,
+    "not": operator.not_,
+    "unary_neg": operator.neg,
 })
 
 
-def interpret(node: ast.Expression, sym_tab: SymTab) -> Value:
+# Environment entry for a variable whose declaration has not run, e.g. one
+# declared inside a while loop that never iterated
+_UNDECLARED = object()
+
+type Env = list[Any]
+
+
+def resolve_scopes(node: ast.Expression) -> None:
+    """Sets the `slot` of every Identifier and VarDecl under `node` to the index of
+    its variable in the environment list passed to `interpret`.
+
+    Slots follow the lexical scopes: a Block's variables come after those of the
+    enclosing scopes and their slots are reused once the Block ends."""
+    scopes: list[dict[str, int]] = [{}]
+    next_slot = 0
+
+    def declare(name: str) -> int:
+        nonlocal next_slot
+        scope = scopes[-1]
+        if name not in scope:
+            # A redeclaration keeps the old slot so `interpret` can report it
+            scope[name] = next_slot
+            next_slot += 1
+        return scope[name]
+
+    def lookup(name: str) -> int | None:
+        for scope in reversed(scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    def visit(node: ast.Expression | None) -> None:
+        nonlocal next_slot
+        match node:
+            case ast.Identifier(name=name):
+                node.slot = lookup(name)
+            case ast.BinaryOp(left=left, right=right):
+                visit(left)
+                visit(right)
+            case ast.UnaryOp(expr=expr):
+                visit(expr)
+            case ast.IfExpr(condition=condition, then_expr=then_expr, else_expr=else_expr):
+                visit(condition)
+                visit(then_expr)
+                visit(else_expr)
+            case ast.Call(arguments=arguments):
+                for argument in arguments:
+                    visit(argument)
+            case ast.Block(statements=statements):
+                outer_next_slot = next_slot
+                scopes.append({})
+                for statement in statements:
+                    visit(statement)
+                scopes.pop()
+                next_slot = outer_next_slot
+            case ast.VarDecl(name=name, initializer=initializer):
+                visit(initializer)
+                node.slot = declare(name)
+            case ast.Program(statements=statements):
+                for statement in statements:
+                    visit(statement)
+            case ast.While(condition=condition, statements=statements):
+                visit(condition)
+                for statement in statements:
+                    visit(statement)
+
+    visit(node)
+
+
+def _interpret_and(left: ast.Expression, right: ast.Expression, env: Env) -> Value:
+    if interpret(left, env):
+        return interpret(right, env)
+    return False
+
+
+def _interpret_or(left: ast.Expression, right: ast.Expression, env: Env) -> Value:
+    a = interpret(left, env)
+    if a:
+        return a
+    return interpret(right, env)
+
+
+def _interpret_assign(left: ast.Expression, right: ast.Expression, env: Env) -> Value:
+    if not isinstance(left, ast.Identifier):
+        raise Exception(f"{left.location}: Left side of assignment must be a variable")
+    value = interpret(right, env)
+    slot = left.slot
+    if slot is None or slot >= len(env) or env[slot] is _UNDECLARED:
+        raise NameError(f"Undefined variable: {left.name}")
+    env[slot] = value
+    return None
+
+
+# Binary operators that need more than evaluating both operands and applying
+# a function from the symbol table
+_BINOP_FAST: dict[str, Callable[[ast.Expression, ast.Expression, Env], Value]] = {
+    "and": _interpret_and,
+    "or": _interpret_or,
+    "=": _interpret_assign,
+}
+
+
+def interpret(node: ast.Expression, env: Env) -> Value:
+    """Evaluates `node`, which must have been annotated by `resolve_scopes`.
+    `env` holds the values of the variables in scope, indexed by slot."""
     match node:
         case ast.Literal(value=value):
             return value
-        case ast.Identifier(name=name):
-            return sym_tab.lookup(name)
+        case ast.Identifier(name=name, slot=slot):
+            if slot is None or slot >= len(env) or env[slot] is _UNDECLARED:
+                raise NameError(f"Undefined symbol: {name}")
+            return env[slot]
         case ast.BinaryOp(left=left, op=op, right=right):
-            a = interpret(left, sym_tab)
-            if op == "and":
-                return a and interpret(right, sym_tab) if bool(a) else False
-            elif op == "or":
-                return a or interpret(right, sym_tab) if bool(a) else True
-            else:
-                b: Any = interpret(right, sym_tab)
-                if op == "=":
-                    sym_tab.assign(left.name, b)
-                    return None
-                op_func = sym_tab.lookup(op)
-                return op_func(a, b)
+            special = _BINOP_FAST.get(op)
+            if special is not None:
+                return special(left, right, env)
+            a = interpret(left, env)
+            b: Any = interpret(right, env)
+            op_func = GLOBAL_SYMBOLS.lookup(op)
+            return op_func(a, b)
         case ast.UnaryOp(op=op, expr=expr):
-            a: Any = interpret(expr, sym_tab)
+            a: Any = interpret(expr, env)
             if op == "-":
-                op_func = sym_tab.lookup("unary_neg")
+                op_func = GLOBAL_SYMBOLS.lookup("unary_neg")
                 return op_func(a)
-            op_func = sym_tab.lookup(op)
+            op_func = GLOBAL_SYMBOLS.lookup(op)
             return op_func(a)
         case ast.IfExpr(condition=condition, then_expr=then_expr, else_expr=else_expr):
-            if interpret(condition, sym_tab):
-                return interpret(then_expr, sym_tab)
+            if interpret(condition, env):
+                return interpret(then_expr, env)
             else:
-                return interpret(else_expr, sym_tab)
+                return interpret(else_expr, env)
         case ast.Program(statements=statements):
             result = None
             for statement in statements:
-                result = interpret(statement, sym_tab)
+                result = interpret(statement, env)
             return result
         case ast.Block(statements=statements):
-            new_sym_tab = SymTab(locals={}, parent=sym_tab)
+            outer_len = len(env)
             result = None
             for statement in statements:
-                result = interpret(statement, new_sym_tab)
+                result = interpret(statement, env)
+            del env[outer_len:]
             return result
-        case ast.VarDecl(name=name, initializer=initializer):
-            value = interpret(initializer, sym_tab)
-            if name in sym_tab.locals:
-                raise NameError(f"Variable {name} already declared")
-            sym_tab.locals[name] = value
+        case ast.VarDecl(name=name, initializer=initializer, slot=slot):
+            if slot is None:
+                raise Exception(f"{node.location}: resolve_scopes has not been run")
+            value = interpret(initializer, env)
+            if slot < len(env):
+                if env[slot] is not _UNDECLARED:
+                    raise NameError(f"Variable {name} already declared")
+                env[slot] = value
+            else:
+                env.extend([_UNDECLARED] * (slot - len(env)))
+                env.append(value)
             return value
         case ast.Call(function=function, arguments=arguments):
             if function[:5] == "print":
                 if isinstance(arguments[0], ast.Identifier):
-                    value = interpret(arguments[0], sym_tab)
+                    value = interpret(arguments[0], env)
                 else:
                     value = arguments[0].value
             if function == "print_int":
@@ -120,19 +231,121 @@ def interpret(node: ast.Expression, sym_tab: SymTab) -> Value:
                 raise Exception(f"Unexpected function: {function}")
         case ast.While(condition=condition, statements=statements):
             result = None
-            while interpret(condition, sym_tab):
+            while interpret(condition, env):
                 for statement in statements:
-                    result = interpret(statement, sym_tab)
+                    result = interpret(statement, env)
             return result
         case _:
             raise Exception(f"Unknown type: {type(node)}")
 
 
-parsed = parser("""
-var x = 0;
-while x < 3 do {
-x = x + 1;
-print_int(x)}
-""")
-global_sym_tab = SymTab({}, GLOBAL_SYMBOLS)
-print(interpret(parsed, global_sym_tab))
+def _ir_div(a: int, b: int) -> int:
+    """Integer division rounding towards zero, like `idivq`"""
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def _ir_rem(a: int, b: int) -> int:
+    return a - b * _ir_div(a, b)
+
+
+def _ir_print_int(a: int) -> None:
+    print(a)
+
+
+def _ir_print_bool(a: bool) -> None:
+    print("true" if a else "false")
+
+
+def _ir_read_int() -> int:
+    return int(input())
+
+
+# Functions callable from IR, with the same semantics as the intrinsics and stdlib
+_IR_FUNCTIONS: dict[str, Callable[..., Any]] = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": _ir_div,
+    "%": _ir_rem,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "unary_-": operator.neg,
+    "unary_not": operator.not_,
+    "print_int": _ir_print_int,
+    "print_bool": _ir_print_bool,
+    "read_int": _ir_read_int,
+}
+
+
+# Each handler executes one instruction and returns the name of the label
+# to continue from, or None to fall through to the next instruction
+def _exec_load_const(insn: ir.LoadIntConst | ir.LoadBoolConst, values: dict[ir.IRVar, Any]) -> str | None:
+    values[insn.dest] = insn.value
+    return None
+
+
+def _exec_copy(insn: ir.Copy, values: dict[ir.IRVar, Any]) -> str | None:
+    values[insn.dest] = values[insn.source]
+    return None
+
+
+def _exec_call(insn: ir.Call, values: dict[ir.IRVar, Any]) -> str | None:
+    values[insn.dest] = _IR_FUNCTIONS[insn.fun.name](*[values[arg] for arg in insn.args])
+    return None
+
+
+def _exec_label(insn: ir.Label, values: dict[ir.IRVar, Any]) -> str | None:
+    return None
+
+
+def _exec_jump(insn: ir.Jump, values: dict[ir.IRVar, Any]) -> str | None:
+    return insn.label.name
+
+
+def _exec_cond_jump(insn: ir.CondJump, values: dict[ir.IRVar, Any]) -> str | None:
+    label = insn.then_label if values[insn.cond] else insn.else_label
+    return label.name if label is not None else None
+
+
+_IR_HANDLERS: dict[type, Callable[[Any, dict[ir.IRVar, Any]], str | None]] = {
+    ir.LoadIntConst: _exec_load_const,
+    ir.LoadBoolConst: _exec_load_const,
+    ir.Copy: _exec_copy,
+    ir.Call: _exec_call,
+    ir.Label: _exec_label,
+    ir.Jump: _exec_jump,
+    ir.CondJump: _exec_cond_jump,
+}
+
+
+def exec_ir(instructions: list[ir.Instruction]) -> None:
+    """Runs the IR from `generate_ir` directly, as a flat loop over the
+    instructions instead of a recursive walk over the AST"""
+    label_index = {insn.name: i for i, insn in enumerate(instructions) if isinstance(insn, ir.Label)}
+    handlers = _IR_HANDLERS
+    # Unit-valued branches copy `unit` before anything has written it
+    values: dict[ir.IRVar, Any] = {VAR_UNIT: None}
+    pc = 0
+    end = len(instructions)
+    while pc < end:
+        insn = instructions[pc]
+        pc += 1
+        target = handlers[type(insn)](insn, values)
+        if target is not None:
+            pc = label_index[target]
+
+
+if __name__ == "__main__":
+    parsed = parser("""
+    var x = 0;
+    while x < 3 do {
+    x = x + 1;
+    print_int(x)}
+    """)
+    resolve_scopes(parsed)
+    print(interpret(parsed, []))
@@ -1,78 +1,120 @@
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, field, fields
+from instrinsics import Intrinsic
 from tokenizer import Location
 from typing import Any
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class IRVar:
     """Represents the name of a memory location or built-in"""
     name: str
+    # Small unique number given at interning, for indexing per-variable lists. Only
+    # `get` sets it, so an IRVar built directly fails on use instead of sharing an index
+    id: int = field(init=False, compare=False, repr=False)
 
     def __str__(self) -> str:
         return self.name
 
+    @classmethod
+    def get(cls, name: str) -> "IRVar":
+        """Returns the interned IRVar for `name`, so that equal names share one object
+        and dict lookups can succeed on the identity check alone"""
+        var = _INTERN.get(name)
+        if var is None:
+            var = cls(name)
+            object.__setattr__(var, "id", len(_INTERN))
+            _INTERN[name] = var
+        return var
 
-@dataclass(frozen=True)
+
+_INTERN: dict[str, IRVar] = {}
+
+
+@dataclass(frozen=True, slots=True)
 class Instruction:
     """Base class for IR instructions"""
     location: Location
 
     def __str__(self) -> str:
         """Returns a string representation similar to IR code examples, e.g. 'LoadIntConst(3, x1)'"""
-        def format_value(v: Any) -> str:
-            if isinstance(v, list):
-                return f'[{", ".join(format_value(e) for e in v)}]'
-            else:
-                return str(v)
         args = ', '.join(
-            format_value(getattr(self, field.name)) for field in fields(self)
-            if field.name != 'location'
+            _format_value(getattr(self, name)) for name in _printed_fields(type(self))
         )
         return f'{type(self).__name__}({args})'
 
 
-@dataclass(frozen=True)
+_PRINTED_FIELDS: dict[type, tuple[str, ...]] = {}
+
+
+def _printed_fields(cls: type) -> tuple[str, ...]:
+    """Names of the fields shown by `Instruction.__str__`, computed once per class
+    instead of walking `dataclasses.fields` for every instruction"""
+    names = _PRINTED_FIELDS.get(cls)
+    if names is None:
+        names = _PRINTED_FIELDS[cls] = tuple(f.name for f in fields(cls) if f.name != 'location' and f.repr)
+    return names
+
+
+def _format_value(v: Any) -> str:
+    if isinstance(v, list):
+        return f'[{", ".join(_format_value(e) for e in v)}]'
+    else:
+        return str(v)
+
+
+@dataclass(frozen=True, slots=True)
 class LoadBoolConst(Instruction):
     """Loads a boolean constant value to `dest`"""
     value: bool
     dest: IRVar
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class LoadIntConst(Instruction):
     """Loads constant value to `dest`"""
     value: int
     dest: IRVar
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Copy(Instruction):
     """Copies a value from one variable to another"""
     source: IRVar
     dest: IRVar
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Call(Instruction):
     """Calls a function or built-in"""
     fun: IRVar
     args: list[IRVar]
     dest: IRVar
+    # Resolved when the IR is generated; None for calls to external functions
+    intrinsic: Intrinsic | None = field(default=None, compare=False, repr=False)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Label(Instruction):
     """Marks the destination of a jump instruction"""
     name: str
+    # Assembly spellings of the label, built once instead of at every jump to it
+    asm_ref: str = field(init=False, repr=False, compare=False)
+    asm_def: str = field(init=False, repr=False, compare=False)
+    jmp_line: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, 'asm_ref', f'.{self.name}')
+        object.__setattr__(self, 'asm_def', f'.{self.name}:')
+        object.__setattr__(self, 'jmp_line', f'jmp .{self.name}')
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Jump(Instruction):
     """Unconditionally continues execution from the given label"""
     label: Label
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CondJump(Instruction):
     """Continues execution from the `then_label` if `cond` is true, otherwise from `else_label`"""
     cond: IRVar
@@ -2,421 +2,674 @@ import ir
 import astree as ast
 from datatypes import Bool, Int, Type, Unit, IntType, BoolType, UnitType
 from tokenizer import Location
-from parser import parser
-from dataclasses import dataclass
-from typing import Any, Optional
+from instrinsics import all_intrinsics
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Optional
+import sys
 
 
-@dataclass
+@dataclass(slots=True)
 class SymTab:
-    locals: dict[(str | None, Type), ir.IRVar]
+    """Maps names to their IR variable together with its type, so that one
+    lookup answers both"""
+    locals: dict[str, tuple[ir.IRVar, Type]] = field(default_factory=dict)
     parent: Optional["SymTab"] = None
 
-    def local_lookup(self, name: str, t: Type) -> Any:
-        return self.locals[(name, t)] if (name, t) in self.locals else None
+    def local_lookup(self, name: str) -> tuple[ir.IRVar, Type] | None:
+        return self.locals.get(name)
 
-    def lookup(self, name: str, t: Type) -> Any:
-        if (name, t) in self.locals:
-            return self.locals[(name, t)]
-        elif self.parent is not None:
-            return self.parent.lookup(name, t)
-        else:
-            return None
+    def lookup(self, name: str) -> tuple[ir.IRVar, Type] | None:
+        table: SymTab | None = self
+        while table is not None:
+            entry = table.locals.get(name)
+            if entry is not None:
+                return entry
+            table = table.parent
+        return None
+
+
+class ScopeStack:
+    """The scopes open during IR generation, flattened into one table that maps each
+    name to a stack of its visible entries, innermost last. A lookup reads the top of
+    one stack however deeply scopes are nested, and leaving a scope pops the names it
+    declared."""
+    __slots__ = ("entries", "scopes")
 
+    def __init__(self, root_table: SymTab) -> None:
+        self.entries: dict[str, list[tuple[ir.IRVar, Type]]] = {}
+        # The root table's chain is visible everywhere but belongs to no open scope
+        table: SymTab | None = root_table
+        while table is not None:
+            for name, entry in table.locals.items():
+                self.entries.setdefault(name, [entry])
+            table = table.parent
+        # Entries declared in each open scope
+        self.scopes: list[dict[str, tuple[ir.IRVar, Type]]] = [{}]
 
-def generate_ir(root_table: SymTab, root_expr: ast.Expression) -> list[ir.Instruction]:
-    var_unit = ir.IRVar('unit')
-    counter = 1
-    ins: list[ir.Instruction] = []
-    label_counter = 1
+    def enter_scope(self) -> None:
+        self.scopes.append({})
 
-    def new_var(t: Type, st: SymTab, name: str | None = None):
-        nonlocal counter
-        var = ir.IRVar(f"x{counter}")
-        if name is not None:
-            st.locals[(name, t)] = var
+    def exit_scope(self) -> None:
+        entries = self.entries
+        for name in self.scopes.pop():
+            stack = entries[name]
+            stack.pop()
+            if not stack:
+                del entries[name]
+
+    def declare(self, name: str, entry: tuple[ir.IRVar, Type]) -> None:
+        self.scopes[-1][name] = entry
+        stack = self.entries.get(name)
+        if stack is None:
+            self.entries[name] = [entry]
         else:
-            st.locals[(str(var), t)] = var
-        counter += 1
-        return var, st
-
-    def new_label(loc: Location) -> ir.Label:
-        nonlocal label_counter
-        label_name = ir.Label(loc, f"L{label_counter}")
-        label_counter += 1
+            stack.append(entry)
+
+    def local_lookup(self, name: str) -> tuple[ir.IRVar, Type] | None:
+        return self.scopes[-1].get(name)
+
+    def lookup(self, name: str) -> tuple[ir.IRVar, Type] | None:
+        stack = self.entries.get(name)
+        return stack[-1] if stack is not None else None
+
+
+_TYPE_MAP: dict[type, Type] = {IntType: Int, BoolType: Bool}
+
+
+def _runtime_type(t: Type) -> Type:
+    """Int or Bool for the corresponding AST types, otherwise Unit.
+    The AST's default type is the UnitType class itself, which maps to Unit too."""
+    return _TYPE_MAP.get(t.__class__, Unit)
+
+
+def _type_of(entry: tuple[ir.IRVar, Type] | None) -> Type:
+    """The type of a symbol table entry, or Unit if there is none"""
+    return entry[1] if entry is not None else Unit
+
+
+# The variable holding Unit values, shared by every run
+VAR_UNIT = ir.IRVar.get('unit')
+
+# Built-ins called only for their side effect
+_PRINT_BUILTINS = frozenset({"print_int", "print_bool"})
+
+# Temporary variables x0, x1, ... and label names L0, L1, ..., grown on demand and
+# shared by every generate_ir call so that each name is formatted only once
+_TEMP_VARS: list[ir.IRVar] = []
+_LABEL_NAMES: list[str] = []
+
+
+def _temp_var(n: int) -> ir.IRVar:
+    while n >= len(_TEMP_VARS):
+        _TEMP_VARS.append(ir.IRVar.get(f"x{len(_TEMP_VARS)}"))
+    return _TEMP_VARS[n]
+
+
+def _label_name(n: int) -> str:
+    while n >= len(_LABEL_NAMES):
+        _LABEL_NAMES.append(sys.intern(f"L{len(_LABEL_NAMES)}"))
+    return _LABEL_NAMES[n]
+
+
+# The result of `and`/`or` when the right operand is skipped
+_SHORT_CIRCUIT_VALUES: dict[str, bool] = {"and": False, "or": True}
+
+
+# The type both operands of a binary operator must have, or None if they only need
+# to match each other. Operators without an entry are not checked.
+_OPERAND_TYPES: dict[str, Type | None] = {
+    "==": None, "!=": None,
+    **{op: Int for op in ("+", "-", "*", "/", "%", "<", "<=", ">", ">=")},
+}
+
+# The built-in that prints a variable of each type, for a program ending in a variable
+_PRINT_FUNCTIONS: dict[Type, str] = {Int: "print_int", Bool: "print_bool"}
+
+
+def _declares_in_scope(expr: ast.Expression) -> bool:
+    """Whether evaluating `expr` declares a variable in the current scope. A while
+    loop declares its body's variables in the enclosing scope, so loops are searched
+    wherever they appear; nested blocks are not, since a block that declares
+    variables opens its own scope"""
+    if isinstance(expr, ast.VarDecl):
+        return True
+    elif isinstance(expr, ast.While):
+        return _declares_in_scope(expr.condition) or _block_has_decls(expr.statements)
+    elif isinstance(expr, ast.BinaryOp):
+        return _declares_in_scope(expr.left) or _declares_in_scope(expr.right)
+    elif isinstance(expr, ast.UnaryOp):
+        return _declares_in_scope(expr.expr)
+    elif isinstance(expr, ast.IfExpr):
+        return (_declares_in_scope(expr.condition) or _declares_in_scope(expr.then_expr)
+                or (expr.else_expr is not None and _declares_in_scope(expr.else_expr)))
+    elif isinstance(expr, ast.Call):
+        return any(_declares_in_scope(arg) for arg in expr.arguments)
+    else:
+        return False
+
+
+def _block_has_decls(statements: list[ast.Expression]) -> bool:
+    """Whether any of a block's statements declares a variable in the block's scope"""
+    return any(_declares_in_scope(stmt) for stmt in statements)
+
+
+class IRGenerator:
+    """Generates IR for one expression tree. The generation state lives on the
+    instance, and each AST node class has its own `visit_*` method"""
+
+    def __init__(self, root_table: SymTab) -> None:
+        self.root_table = root_table
+        self.var_unit = VAR_UNIT
+        self.counter = 1
+        self.label_counter = 1
+        self.ins: list[ir.Instruction] = []
+        self.emit = self.ins.append
+        # `unit` is not created by new_var but can still be copied from.
+        self.all_vars: list[ir.IRVar] = [self.var_unit]
+        # The type of every variable made by new_var, to type an operand from its IRVar
+        self.var_types: dict[ir.IRVar, Type] = {}
+        # Operators cannot be shadowed by user names, so they are resolved in the root
+        # table once per run instead of walking every scope at each use.
+        self.operators: dict[str, tuple[ir.IRVar, Type]] = {}
+        self.handlers: dict[type, Callable[[ScopeStack, Any], ir.IRVar]] = {
+            ast.Literal: self.visit_literal,
+            ast.Identifier: self.visit_identifier,
+            ast.BinaryOp: self.visit_binary_op,
+            ast.IfExpr: self.visit_if_expr,
+            ast.Call: self.visit_call,
+            ast.Block: self.visit_block,
+            ast.UnaryOp: self.visit_unary_op,
+            ast.VarDecl: self.visit_var_decl,
+            ast.While: self.visit_while,
+            ast.Program: self.visit_program,
+        }
+
+    def run(self, root_expr: ast.Expression) -> tuple[list[ir.Instruction], list[ir.IRVar]]:
+        self.visit(ScopeStack(self.root_table), root_expr)
+        ins, all_vars = copy_propagate(self.ins, self.all_vars)
+        return layout_blocks(ins), all_vars
+
+    def new_var(self, t: Type, st: ScopeStack, name: str | None = None) -> ir.IRVar:
+        var = _temp_var(self.counter)
+        self.all_vars.append(var)
+        self.var_types[var] = t
+        st.declare(name if name is not None else var.name, (var, t))
+        self.counter += 1
+        return var
+
+    def operator_entry(self, name: str) -> tuple[ir.IRVar, Type] | None:
+        entry = self.operators.get(name)
+        if entry is None:
+            entry = self.root_table.lookup(name)
+            if entry is not None:
+                self.operators[name] = entry
+        return entry
+
+    def new_label(self, loc: Location) -> ir.Label:
+        label_name = ir.Label(loc, _label_name(self.label_counter))
+        self.label_counter += 1
         return label_name
 
-    def visit(st: SymTab, expr: ast.Expression, final_expression: bool = False) -> ir.IRVar | SymTab:
+    def visit(self, st: ScopeStack, expr: ast.Expression) -> ir.IRVar:
+        handler = self.handlers.get(type(expr))
+        if handler is None:
+            raise Exception(f"{expr.location}: Unknown AST node type: {type(expr).__name__}")
+        return handler(st, expr)
+
+    def visit_literal(self, st: ScopeStack, expr: ast.Literal) -> ir.IRVar:
         loc = expr.location
-        match expr:
-            case ast.Literal(value=value):
-                match value:
-                    case bool():
-                        var, st = new_var(Bool, st)
-                        ins.append(ir.LoadBoolConst(loc, value, var))
-                    case int():
-                        var, st = new_var(Int, st)
-                        ins.append(ir.LoadIntConst(loc, value, var))
-                    case None:
-                        var = var_unit
-                    case _:
-                        raise Exception(f"{loc}: unsupported literal: {value}")
-                return var
-            case ast.Identifier(name=name, type=type):
-                if st.lookup(name, Int) is not None:
-                    return st.lookup(name, Int)
-                elif st.lookup(name, Bool) is not None:
-                    return st.lookup(name, Bool)
-                else:
-                    raise Exception(f"{loc}: Unknown identifier {name}")
-            case ast.BinaryOp(left=left, op=op, right=right, type=type):
-                if op == "=":
-                    if not (isinstance(left, ast.BinaryOp) and left.op == "="):
-                        if not isinstance(left, ast.Identifier):
-                            raise Exception(f"{loc}: Left side of assignment must be a variable")
-                        t = Unit
-                        t2 = Unit
-                        if st.lookup(left.name, Int) is not None:
-                            var_left = st.lookup(left.name, Int)
-                            t = Int
-                        elif st.lookup(left.name, Bool) is not None:
-                            var_left = st.lookup(left.name, Bool)
-                            t = Bool
-                        else:
-                            raise Exception(f"{loc}: Unknown identifier {left.name}")
-                        var_right = visit(st, right)
-                        if st.lookup(str(var_right), Int) is not None:
-                            t2 = Int
-                        elif st.lookup(str(var_right), Bool) is not None:
-                            t2 = Bool
-                        if isinstance(right, ast.Identifier):
-                            if st.lookup(right.name, Int) is not None:
-                                t2 = Int
-                            elif st.lookup(right.name, Bool) is not None:
-                                t2 = Bool
-                        if t != t2:
-                            print(var_left, var_right)
-                            print(st)
-                            raise Exception(f"{loc}: assigning to {left.name} expects {t}, got {t2}")
-                        ins.append(ir.Copy(loc, var_right, var_left))
-                        return var_left
-                    else:
-                        var_right = visit(st, right)
-                        if st.local_lookup(left.right.name, Int) is not None:
-                            ins.append(ir.Copy(loc, var_right, st.local_lookup(left.right.name, Int)))
-                        elif st.local_lookup(left.right.name, Bool) is not None:
-                            ins.append(ir.Copy(loc, var_right, st.local_lookup(left.right.name, Bool)))
-                        else:
-                            raise Exception(f"{loc}: Undefined variable: {left.right.name}")
-                        var_left = visit(st, left)
-                        return var_left
-                elif op in {"and", "or"}:
-                    l_skip = new_label(loc)
-                    l_right = new_label(loc)
-                    l_end = new_label(loc)
-                    var_left = visit(st, left)
-                    if op == "and":
-                        ins.append(ir.CondJump(loc, var_left, l_skip, l_right))
-                    else:
-                        ins.append(ir.CondJump(loc, var_left, l_right, l_skip))
-                    ins.append(l_skip)
-                    var_right = visit(st, right)
-                    left_type = Unit
-                    right_type = Unit
-                    if isinstance(left, ast.Block):
-                        left = left.result_expr
-                    if isinstance(left, ast.Identifier) and st.local_lookup(left.name, Bool) is not None:
-                        left_type = Bool
-                    elif st.local_lookup(str(var_left), Bool) is not None:
-                        left_type = Bool
-                    elif isinstance(left, ast.Literal) and isinstance(left.type, BoolType):
-                        left_type = Bool
-                    if isinstance(right, ast.Block):
-                        right = right.result_expr
-                    if isinstance(right, ast.Identifier) and st.local_lookup(right.name, Bool) is not None:
-                        right_type = Bool
-                    elif st.local_lookup(str(var_right), Bool) is not None:
-                        right_type = Bool
-                    elif isinstance(right, ast.Literal) and isinstance(right.type, BoolType):
-                        right_type = Bool
-                    if not isinstance(left_type, BoolType) or not isinstance(right_type, BoolType):
-                        raise Exception(f"{loc}: {op} requires two Bools, got {left_type} and {right_type}")
-                    extra_var, st = new_var(Bool, st)
-                    ins.append(ir.Copy(loc, var_right, extra_var))
-                    ins.append(ir.Jump(loc, l_end))
-                    ins.append(l_right)
-                    if op == "and":
-                        ins.append(ir.LoadBoolConst(loc, False, extra_var))
-                    else:
-                        ins.append(ir.LoadBoolConst(loc, True, extra_var))
-                    ins.append(ir.Jump(loc, l_end))
-                    ins.append(l_end)
-                    return extra_var
-                else:
-                    t = Unit
-                    if isinstance(type, IntType):
-                        t = Int
-                    elif isinstance(type, BoolType):
-                        t = Bool
-                    var_op = st.lookup(op, t)
-                    if var_op is None:
-                        raise Exception(f"{loc}: Unknown operator {op}")
-                    var_left = visit(st, left)
-                    var_right = visit(st, right)
-                    left_type = Unit
-                    right_type = Unit
-                    if isinstance(left, ast.Block):
-                        left = left.result_expr
-                    if isinstance(left, ast.BinaryOp):
-                        if isinstance(left.type, IntType):
-                            left_type = Int
-                        elif isinstance(left.type, BoolType):
-                            left_type = Bool
-                    elif isinstance(left, ast.Identifier):
-                        if st.lookup(left.name, Int) is not None:
-                            left_type = Int
-                        elif st.lookup(left.name, Bool) is not None:
-                            left_type = Bool
-                    else:
-                        if st.lookup(str(var_left), Int) is not None:
-                            left_type = Int
-                        elif st.lookup(str(var_left), Bool) is not None:
-                            left_type = Bool
-                    if isinstance(right, ast.Block):
-                        right = right.result_expr
-                    if isinstance(right, ast.BinaryOp):
-                        if isinstance(right.type, IntType):
-                            right_type = Int
-                        elif isinstance(right.type, BoolType):
-                            right_type = Bool
-                    elif isinstance(right, ast.Identifier):
-                        if st.lookup(right.name, Int) is not None:
-                            right_type = Int
-                        elif st.lookup(right.name, Bool) is not None:
-                            right_type = Bool
-                    else:
-                        if st.lookup(str(var_right), Int) is not None:
-                            right_type = Int
-                        elif st.lookup(str(var_right), Bool) is not None:
-                            right_type = Bool
-                    if op in {"==", "!="}:
-                        if left_type != right_type:
-                            raise Exception(f"{loc}: {op} requires two of the same type, got {left_type} and {right_type}")
-                    elif op in {"+", "-", "*", "/", "%", "<", "<=", ">", ">="}:
-                        if not isinstance(left_type, IntType) or not isinstance(right_type, IntType):
-                            raise Exception(f"{loc}: {op} requires two integers, got {left_type} and {right_type}")
-                    var_result, st = new_var(t, st)
-                    ins.append(ir.Call(loc, var_op, [var_left, var_right], var_result))
-                    return var_result
-            case ast.IfExpr(condition=condition, then_expr=then_expr, else_expr=else_expr, type=type):
-                if else_expr is not None:
-                    l_then = new_label(loc)
-                    l_else = new_label(loc)
-                    l_end = new_label(loc)
-                    var_cond = visit(st, condition)
-                    ins.append(ir.CondJump(loc, var_cond, l_then, l_else))
-                    ins.append(l_then)
-                    t = Unit
-                    if isinstance(type, IntType):
-                        t = Int
-                    elif isinstance(type, BoolType):
-                        t = Bool
-                    var_result, st = new_var(t, st)
-                    var_then = visit(st, then_expr)
-                    ins.append(ir.Copy(loc, var_then, var_result))
-                    ins.append(ir.Jump(loc, l_end))
-                    ins.append(l_else)
-                    var_else = visit(st, else_expr)
-                    ins.append(ir.Copy(loc, var_else, var_result))
-                    ins.append(l_end)
-                    return var_result
-                else:
-                    l_then = new_label(loc)
-                    l_end = new_label(loc)
-                    var_cond = visit(st, condition)
-                    ins.append(ir.CondJump(loc, var_cond, l_then, l_end))
-                    ins.append(l_then)
-                    var_then = visit(st, then_expr)
-                    ins.append(ir.Jump(loc, l_end))
-                    ins.append(l_end)
-                    return var_unit
-            case ast.Call(function=function, arguments=arguments):
-                var_func = ir.IRVar(function)
-                var_args = [visit(st, arg) for arg in arguments]
-                var_result, st = new_var(Unit, st)
-                ins.append(ir.Call(loc, var_func, var_args, var_result))
-                if function == "print_int":
-                    for i in range(len(arguments)):
-                        if isinstance(arguments[i], ast.Identifier):
-                            if st.lookup(arguments[i].name, Int) is None:
-                                raise Exception(f"{loc}: {function} takes only int as argument")
-                        elif isinstance(arguments[i], ast.Call):
-                            if arguments[i].function != "read_int":
-                                raise Exception(f"{loc}: {function} takes only int as argument")
-                        else:
-                            if not isinstance(arguments[i].type, IntType):
-                                raise Exception(f"{loc}: {function} takes only int as argument")
-                elif function == "print_bool":
-                    for i in range(len(arguments)):
-                        if isinstance(arguments[i], ast.Identifier):
-                            if st.lookup(arguments[i].name, Bool) is None:
-                                raise Exception(f"{loc}: {function} takes only bool as argument")
-                        else:
-                            if not isinstance(arguments[i].type, BoolType):
-                                raise Exception(f"{loc}: {function} takes only bool as argument")
-                return var_result
-            case ast.Block(statements=statements, result_expr=result_expr):
-                block_sym_tab = SymTab({}, st)
-                if result_expr is not None:
-                    for i in range(len(statements) - 1):
-                        visit(block_sym_tab, statements[i])
-                    if final_expression:
-                        return block_sym_tab
-                    else:
-                        var_result = visit(block_sym_tab, result_expr)
-                        return var_result
-                else:
-                    for stmt in statements:
-                        visit(block_sym_tab, stmt)
-                    return var_unit
-            case ast.UnaryOp(op=op, expr=expr):
-                if op == "-":
-                    neg = "unary_-"
-                    type = Int
-                    var_op = st.lookup(neg, type)
-                else:
-                    neg = "unary_not"
-                    type = Bool
-                    var_op = st.lookup(neg, type)
-                if var_op is None:
-                    raise Exception(f"{loc}: Unknown operator {neg}")
-                var_operand = visit(st, expr)
-                var_result, st = new_var(type, st)
-                if str(var_op) == "unary_not":
-                    if isinstance(expr, ast.Identifier):
-                        if st.lookup(expr.name, Bool) is None:
-                            raise Exception(f"{loc}: {var_operand} requires bool")
-                    elif st.lookup(str(var_operand), Bool) is None:
-                        raise Exception(f"{loc}: {var_operand} requires bool")
-                elif str(var_op) == "unary_-":
-                    if isinstance(expr, ast.Identifier):
-                        if st.lookup(expr.name, Int) is None:
-                            raise Exception(f"{loc}: {var_op} requires int")
-                    elif st.lookup(str(var_operand), Int) is None:
-                        raise Exception(f"{loc}: {var_op} requires int")
-                ins.append(ir.Call(loc, var_op, [var_operand], var_result))
-                return var_result
-            case ast.VarDecl(name=name, initializer=initializer, type=type):
-                t = Unit
-                t2 = Unit
-                if isinstance(initializer, ast.Block):
-                    if initializer.result_expr is not None:
-                        if isinstance(initializer.result_expr.type, IntType):
-                            t = Int
-                        elif isinstance(initializer.result_expr.type, BoolType):
-                            t = Bool
-                    else:
-                        raise Exception(f"{loc}: Block needs a result expression to be equal to variable")
-                elif isinstance(initializer, ast.Call):
-                    t = Int
-                    if type == UnitType:
-                        t2 = Int
-                elif isinstance(initializer, ast.Identifier):
-                    if st.lookup(initializer.name, Int) is not None:
-                        t = Int
-                        if type == UnitType:
-                            t2 = Int
-                    elif st.lookup(initializer.name, Bool) is not None:
-                        t = Bool
-                        if type == UnitType:
-                            t2 = Bool
-                    else:
-                        raise Exception(f"{loc}: unknown initializer {initializer.name}")
-                else:
-                    if isinstance(initializer.type, IntType):
-                        t = Int
-                    elif isinstance(initializer.type, BoolType):
-                        t = Bool
-                if isinstance(type, BoolType):
-                    t2 = Bool
-                elif isinstance(type, IntType):
-                    t2 = Int
-                if t != t2:
-                    raise Exception(f"{loc}: expected {t2}, got {t}")
-                if st.local_lookup(name, t) is None:
-                    var_value = visit(st, initializer)
-                    var_decl, st = new_var(t, st, name)
-                    ins.append(ir.Copy(loc, var_value, var_decl))
-                    return var_unit
+        value = expr.value
+        match value:
+            case bool():
+                var = self.new_var(Bool, st)
+                self.emit(ir.LoadBoolConst(loc, value, var))
+            case int():
+                var = self.new_var(Int, st)
+                self.emit(ir.LoadIntConst(loc, value, var))
+            case None:
+                var = self.var_unit
+            case _:
+                raise Exception(f"{loc}: unsupported literal: {value}")
+        return var
+
+    def visit_identifier(self, st: ScopeStack, expr: ast.Identifier) -> ir.IRVar:
+        loc = expr.location
+        name = expr.name
+        entry = st.lookup(name)
+        if entry is None or entry[1] is Unit:
+            raise Exception(f"{loc}: Unknown identifier {name}")
+        return entry[0]
+
+    def visit_binary_op(self, st: ScopeStack, expr: ast.BinaryOp) -> ir.IRVar:
+        loc = expr.location
+        left = expr.left
+        op = expr.op
+        right = expr.right
+        type = expr.type
+        if op == "=":
+            # `a = b = c` parses as `(a = b) = c`: walk down the chain copying each value
+            # into the next variable, then finish with the plain `a = b` at its end
+            while isinstance(left, ast.BinaryOp) and left.op == "=":
+                var_right = self.visit(st, right)
+                entry = st.local_lookup(left.right.name)
+                if entry is None or entry[1] is Unit:
+                    raise Exception(f"{loc}: Undefined variable: {left.right.name}")
+                self.emit(ir.Copy(loc, var_right, entry[0]))
+                loc, right = left.location, left.right
+                left = left.left
+            if not isinstance(left, ast.Identifier):
+                raise Exception(f"{loc}: Left side of assignment must be a variable")
+            entry = st.lookup(left.name)
+            if entry is None or entry[1] is Unit:
+                raise Exception(f"{loc}: Unknown identifier {left.name}")
+            var_left, t = entry
+            var_right = self.visit(st, right)
+            # Visiting an Identifier has already rejected unknown and Unit names
+            if isinstance(right, ast.Identifier):
+                t2 = _type_of(st.lookup(right.name))
+            else:
+                t2 = self.var_types.get(var_right, Unit)
+            if t is not t2:
+                raise Exception(f"{loc}: assigning to {left.name} expects {t}, got {t2}")
+            self.emit(ir.Copy(loc, var_right, var_left))
+            return var_left
+        elif op in _SHORT_CIRCUIT_VALUES:
+            return self.visit_short_circuit(st, loc, op, left, right)
+        else:
+            t = _runtime_type(type)
+            entry = self.operator_entry(op)
+            if entry is None or entry[1] is not t:
+                raise Exception(f"{loc}: Unknown operator {op}")
+            var_op = entry[0]
+            var_left = self.visit(st, left)
+            var_right = self.visit(st, right)
+            left_type = self.operand_type(st, left, var_left)
+            right_type = self.operand_type(st, right, var_right)
+            operand_type = _OPERAND_TYPES.get(op, Unit)
+            if operand_type is None:
+                if left_type is not right_type:
+                    raise Exception(f"{loc}: {op} requires two of the same type, got {left_type} and {right_type}")
+            elif operand_type is Int:
+                if left_type is not Int or right_type is not Int:
+                    raise Exception(f"{loc}: {op} requires two integers, got {left_type} and {right_type}")
+            var_result = self.new_var(t, st)
+            self.emit(ir.Call(loc, var_op, [var_left, var_right], var_result, all_intrinsics.get(var_op.name)))
+            return var_result
+
+    def operand_type(self, st: ScopeStack, expr: ast.Expression | None, var: ir.IRVar) -> Type:
+        """The type of an arithmetic or comparison operand `expr` whose value is in `var`"""
+        if isinstance(expr, ast.Block):
+            expr = expr.result_expr
+        if isinstance(expr, ast.BinaryOp):
+            return _runtime_type(expr.type)
+        elif isinstance(expr, ast.Identifier):
+            return _type_of(st.lookup(expr.name))
+        else:
+            return self.var_types.get(var, Unit)
+
+    def is_bool_operand(self, st: ScopeStack, expr: ast.Expression | None, var: ir.IRVar) -> bool:
+        """Whether an `and`/`or` operand `expr` whose value is in `var` is a Bool"""
+        if isinstance(expr, ast.Block):
+            expr = expr.result_expr
+        if isinstance(expr, ast.Identifier) and _type_of(st.local_lookup(expr.name)) is Bool:
+            return True
+        return self.var_types.get(var, Unit) is Bool or (isinstance(expr, ast.Literal) and expr.type is Bool)
+
+    def visit_short_circuit(self, st: ScopeStack, loc: Location, op: str,
+                            left: ast.Expression, right: ast.Expression) -> ir.IRVar:
+        """Lowers `and`/`or`, evaluating `right` only when `left` does not already
+        decide the result"""
+        short_value = _SHORT_CIRCUIT_VALUES[op]
+        l_eval_right = self.new_label(loc)
+        l_short = self.new_label(loc)
+        l_end = self.new_label(loc)
+        var_left = self.visit(st, left)
+        if short_value:
+            cond_jump = ir.CondJump(loc, var_left, l_short, l_eval_right)
+        else:
+            cond_jump = ir.CondJump(loc, var_left, l_eval_right, l_short)
+        self.ins.extend((cond_jump, l_eval_right))
+        var_right = self.visit(st, right)
+        left_type = Bool if self.is_bool_operand(st, left, var_left) else Unit
+        right_type = Bool if self.is_bool_operand(st, right, var_right) else Unit
+        if left_type is not Bool or right_type is not Bool:
+            raise Exception(f"{loc}: {op} requires two Bools, got {left_type} and {right_type}")
+        extra_var = self.new_var(Bool, st)
+        self.ins.extend((
+            ir.Copy(loc, var_right, extra_var),
+            ir.Jump(loc, l_end),
+            l_short,
+            ir.LoadBoolConst(loc, short_value, extra_var),
+            l_end,
+        ))
+        return extra_var
+
+    def visit_if_expr(self, st: ScopeStack, expr: ast.IfExpr) -> ir.IRVar:
+        loc = expr.location
+        condition = expr.condition
+        then_expr = expr.then_expr
+        else_expr = expr.else_expr
+        type = expr.type
+        if else_expr is not None:
+            l_then = self.new_label(loc)
+            l_else = self.new_label(loc)
+            l_end = self.new_label(loc)
+            var_cond = self.visit(st, condition)
+            self.emit(ir.CondJump(loc, var_cond, l_then, l_else))
+            self.emit(l_then)
+            t = _runtime_type(type)
+            var_result = self.new_var(t, st)
+            var_then = self.visit(st, then_expr)
+            self.emit(ir.Copy(loc, var_then, var_result))
+            self.emit(ir.Jump(loc, l_end))
+            self.emit(l_else)
+            var_else = self.visit(st, else_expr)
+            self.emit(ir.Copy(loc, var_else, var_result))
+            self.emit(l_end)
+            return var_result
+        else:
+            l_then = self.new_label(loc)
+            l_end = self.new_label(loc)
+            var_cond = self.visit(st, condition)
+            self.emit(ir.CondJump(loc, var_cond, l_then, l_end))
+            self.emit(l_then)
+            var_then = self.visit(st, then_expr)
+            self.emit(l_end)
+            return self.var_unit
+
+    def visit_call(self, st: ScopeStack, expr: ast.Call) -> ir.IRVar:
+        loc = expr.location
+        function = expr.function
+        arguments = expr.arguments
+        var_func = ir.IRVar.get(function)
+        var_args = [self.visit(st, arg) for arg in arguments]
+        if function in _PRINT_BUILTINS:
+            # Nothing reads what a print returns, so it needs no variable of its own
+            var_result = self.var_unit
+        else:
+            var_result = self.new_var(Unit, st)
+        self.emit(ir.Call(loc, var_func, var_args, var_result, all_intrinsics.get(function)))
+        if function == "print_int":
+            for argument in arguments:
+                if isinstance(argument, ast.Identifier):
+                    if _type_of(st.lookup(argument.name)) is not Int:
+                        raise Exception(f"{loc}: {function} takes only int as argument")
+                elif isinstance(argument, ast.Call):
+                    if argument.function != "read_int":
+                        raise Exception(f"{loc}: {function} takes only int as argument")
                 else:
-                    raise Exception(f"{loc}: Variable {name} already declared in this scope")
-            case ast.While(condition=condition, statements=statements):
-                l_cond = new_label(loc)
-                l_body = new_label(loc)
-                l_end = new_label(loc)
-                ins.append(l_cond)
-                var_cond = visit(st, condition)
-                ins.append(ir.CondJump(loc, var_cond, l_body, l_end))
-                ins.append(l_body)
-                for stmt in statements:
-                    visit(st, stmt)
-                ins.append(ir.Jump(loc, l_cond))
-                ins.append(l_end)
-                return var_unit
-            case ast.Program(location=location, statements=statements, result=result):
-                if result is not None:
-                    for i in range(len(statements) - 1):
-                        visit(st, statements[i])
-                    block_st = None
-                    if isinstance(statements[-1], ast.Block):
-                        block_st = visit(st, statements[-1], True)
-                    if block_st is not None and result.function == "print_var":
-                        if block_st.local_lookup(result.arguments[0].name, Int) is not None:
-                            visit(block_st, ast.Call(location, "print_int", result.arguments), True)
-                        elif block_st.local_lookup(result.arguments[0].name, Bool) is not None:
-                            visit(block_st, ast.Call(location, "print_bool", result.arguments), True)
-                    elif result.function == "print_var":
-                        if st.local_lookup(result.arguments[0].name, Int) is not None:
-                            visit(st, ast.Call(location, "print_int", result.arguments), True)
-                        elif st.local_lookup(result.arguments[0].name, Bool) is not None:
-                            visit(st, ast.Call(location, "print_bool", result.arguments), True)
-                    else:
-                        visit(st, result, True)
+                    if argument.type is not Int:
+                        raise Exception(f"{loc}: {function} takes only int as argument")
+        elif function == "print_bool":
+            for argument in arguments:
+                if isinstance(argument, ast.Identifier):
+                    if _type_of(st.lookup(argument.name)) is not Bool:
+                        raise Exception(f"{loc}: {function} takes only bool as argument")
                 else:
-                    for stmt in statements:
-                        visit(st, stmt)
-                return var_unit
-            case _:
-                raise Exception(f"{loc}: Unknown AST node type: {ast}")
-
-    new_sym_tab = SymTab({}, root_table)
-    visit(new_sym_tab, root_expr)
-    return ins
-
-
-GLOBAL_SYMTAB = SymTab({("+", Int): ir.IRVar("+"),
-                        ("-", Int): ir.IRVar("-"),
-                        ("*", Int): ir.IRVar("*"),
-                        ("/", Int): ir.IRVar("/"),
-                        ("%", Int): ir.IRVar("%"),
-                        ("<", Bool): ir.IRVar("<"),
-                        ("<=", Bool): ir.IRVar("<="),
-                        ("==", Bool): ir.IRVar("=="),
-                        (">=", Bool): ir.IRVar(">="),
-                        (">", Bool): ir.IRVar(">"),
-                        ("!=", Bool): ir.IRVar("!="),
-                        ("unary_-", Int): ir.IRVar("unary_-"),
-                        ("unary_not", Bool): ir.IRVar("unary_not"),
-                        ("print_int", Unit): ir.IRVar("print_int"),
-                        ("print_bool", Unit): ir.IRVar("print_bool"),
-                        ("read_int", Unit): ir.IRVar("read_int"),
-                        })
-
-#string = """var x = 3;
-#var y = 4;
-#x = y;
-#x"""
-#tokens = parser(string)
-#ir_lines = generate_ir(GLOBAL_SYMTAB, tokens)
-#for line in ir_lines:
-#    print(line)
+                    if argument.type is not Bool:
+                        raise Exception(f"{loc}: {function} takes only bool as argument")
+        return var_result
+
+    def visit_block(self, st: ScopeStack, expr: ast.Block) -> ir.IRVar:
+        statements = expr.statements
+        result_expr = expr.result_expr
+        # A block without declarations of its own can share the enclosing scope
+        has_scope = _block_has_decls(statements)
+        if has_scope:
+            st.enter_scope()
+        if result_expr is not None:
+            for stmt in statements[:-1]:
+                self.visit(st, stmt)
+            var_result = self.visit(st, result_expr)
+        else:
+            for stmt in statements:
+                self.visit(st, stmt)
+            var_result = self.var_unit
+        if has_scope:
+            st.exit_scope()
+        return var_result
+
+    def visit_final_block(self, st: ScopeStack, expr: ast.Block) -> None:
+        """Visits the statements of a program's final block but not its result
+        expression, and leaves the block's scope open for the program to print from"""
+        statements = expr.statements
+        st.enter_scope()
+        if expr.result_expr is not None:
+            statements = statements[:-1]
+        for stmt in statements:
+            self.visit(st, stmt)
+
+    def visit_unary_op(self, st: ScopeStack, node: ast.UnaryOp) -> ir.IRVar:
+        loc = node.location
+        op = node.op
+        expr = node.expr
+        if op == "-":
+            neg = "unary_-"
+            type = Int
+        else:
+            neg = "unary_not"
+            type = Bool
+        entry = self.operator_entry(neg)
+        if entry is None or entry[1] is not type:
+            raise Exception(f"{loc}: Unknown operator {neg}")
+        var_op = entry[0]
+        var_operand = self.visit(st, expr)
+        var_result = self.new_var(type, st)
+        if neg == "unary_not":
+            if isinstance(expr, ast.Identifier):
+                if _type_of(st.lookup(expr.name)) is not Bool:
+                    raise Exception(f"{loc}: {var_operand} requires bool")
+            elif self.var_types.get(var_operand, Unit) is not Bool:
+                raise Exception(f"{loc}: {var_operand} requires bool")
+        elif neg == "unary_-":
+            if isinstance(expr, ast.Identifier):
+                if _type_of(st.lookup(expr.name)) is not Int:
+                    raise Exception(f"{loc}: {var_op} requires int")
+            elif self.var_types.get(var_operand, Unit) is not Int:
+                raise Exception(f"{loc}: {var_op} requires int")
+        self.emit(ir.Call(loc, var_op, [var_operand], var_result, all_intrinsics.get(var_op.name)))
+        return var_result
+
+    def visit_var_decl(self, st: ScopeStack, expr: ast.VarDecl) -> ir.IRVar:
+        loc = expr.location
+        name = expr.name
+        initializer = expr.initializer
+        type = expr.type
+        t = Unit
+        t2 = Unit
+        if isinstance(initializer, ast.Block):
+            if initializer.result_expr is not None:
+                t = _runtime_type(initializer.result_expr.type)
+            else:
+                raise Exception(f"{loc}: Block needs a result expression to be equal to variable")
+        elif isinstance(initializer, ast.Call):
+            t = Int
+            if type is UnitType:
+                t2 = Int
+        elif isinstance(initializer, ast.Identifier):
+            t = _type_of(st.lookup(initializer.name))
+            if t is Unit:
+                raise Exception(f"{loc}: unknown initializer {initializer.name}")
+            if type is UnitType:
+                t2 = t
+        else:
+            t = _runtime_type(initializer.type)
+        if _runtime_type(type) is not Unit:
+            t2 = _runtime_type(type)
+        if t is not t2:
+            raise Exception(f"{loc}: expected {t2}, got {t}")
+        if st.local_lookup(name) is None:
+            var_value = self.visit(st, initializer)
+            var_decl = self.new_var(t, st, name)
+            self.emit(ir.Copy(loc, var_value, var_decl))
+            return self.var_unit
+        else:
+            raise Exception(f"{loc}: Variable {name} already declared in this scope")
+
+    def visit_while(self, st: ScopeStack, expr: ast.While) -> ir.IRVar:
+        loc = expr.location
+        condition = expr.condition
+        statements = expr.statements
+        l_cond = self.new_label(loc)
+        l_body = self.new_label(loc)
+        l_end = self.new_label(loc)
+        self.emit(l_cond)
+        var_cond = self.visit(st, condition)
+        self.emit(ir.CondJump(loc, var_cond, l_body, l_end))
+        self.emit(l_body)
+        for stmt in statements:
+            self.visit(st, stmt)
+        self.emit(ir.Jump(loc, l_cond))
+        self.emit(l_end)
+        return self.var_unit
+
+    def visit_program(self, st: ScopeStack, expr: ast.Program) -> ir.IRVar:
+        location = expr.location
+        statements = expr.statements
+        result = expr.result
+        if result is not None:
+            for stmt in statements[:-1]:
+                self.visit(st, stmt)
+            final_block = statements[-1] if isinstance(statements[-1], ast.Block) else None
+            if final_block is not None:
+                self.visit_final_block(st, final_block)
+            if result.function == "print_var":
+                # The printed variable is looked up in the final block's scope if there is one
+                print_function = _PRINT_FUNCTIONS.get(_type_of(st.local_lookup(result.arguments[0].name)))
+                if print_function is not None:
+                    self.visit(st, ast.Call(location, print_function, result.arguments))
+                if final_block is not None:
+                    st.exit_scope()
+            else:
+                # Any other result is evaluated outside the final block's scope
+                if final_block is not None:
+                    st.exit_scope()
+                self.visit(st, result)
+        else:
+            for stmt in statements:
+                self.visit(st, stmt)
+        return self.var_unit
+
+
+def generate_ir(root_table: SymTab, root_expr: ast.Expression) -> tuple[list[ir.Instruction], list[ir.IRVar]]:
+    """Returns the IR instructions for `root_expr` together with every variable they use,
+    in order of creation"""
+    return IRGenerator(root_table).run(root_expr)
+
+
+def copy_propagate(instructions: list[ir.Instruction], variables: list[ir.IRVar]) -> tuple[list[ir.Instruction], list[ir.IRVar]]:
+    """Folds each `Copy(src, dest)` into the instruction right before it when that
+    instruction is the only definition of `src` and the copy is the only use of `src`,
+    so the value is written straight to `dest`.
+
+    Returns the remaining instructions and the variables that are still used."""
+    defs: dict[ir.IRVar, int] = {}
+    uses: dict[ir.IRVar, int] = {}
+    for insn in instructions:
+        match insn:
+            case ir.LoadIntConst(dest=dest) | ir.LoadBoolConst(dest=dest):
+                defs[dest] = defs.get(dest, 0) + 1
+            case ir.Copy(source=source, dest=dest):
+                uses[source] = uses.get(source, 0) + 1
+                defs[dest] = defs.get(dest, 0) + 1
+            case ir.Call(args=args, dest=dest):
+                for arg in args:
+                    uses[arg] = uses.get(arg, 0) + 1
+                defs[dest] = defs.get(dest, 0) + 1
+            case ir.CondJump(cond=cond):
+                uses[cond] = uses.get(cond, 0) + 1
+
+    result: list[ir.Instruction] = []
+    removed: set[ir.IRVar] = set()
+    for insn in instructions:
+        if isinstance(insn, ir.Copy) and result:
+            prev = result[-1]
+            source = insn.source
+            if (isinstance(prev, (ir.LoadIntConst, ir.LoadBoolConst, ir.Copy, ir.Call))
+                    and prev.dest == source and defs.get(source) == 1 and uses[source] == 1):
+                result[-1] = replace(prev, dest=insn.dest)
+                removed.add(source)
+                continue
+        result.append(insn)
+    return result, [var for var in variables if var not in removed]
+
+
+def layout_blocks(instructions: list[ir.Instruction]) -> list[ir.Instruction]:
+    """Orders the basic blocks of `instructions` so that a jump target directly follows
+    the jump where possible, letting the assembly generator leave the jump out.
+
+    Blocks are placed in reverse postorder, with the `then` branch of a CondJump placed
+    right after it. A block that falls into the next one gets an explicit Jump only if
+    the new order moves that block elsewhere, and the block that ends the program stays
+    last."""
+    blocks: list[list[ir.Instruction]] = [[]]
+    for insn in instructions:
+        if blocks[-1] and (isinstance(insn, ir.Label) or isinstance(blocks[-1][-1], ir.Jump)):
+            blocks.append([])
+        blocks[-1].append(insn)
+    if len(blocks) == 1:
+        return instructions
+
+    block_index = {block[0].name: i for i, block in enumerate(blocks) if isinstance(block[0], ir.Label)}
+    successors: list[list[int]] = []
+    falls_into: list[ir.Label | None] = []
+    for i, block in enumerate(blocks):
+        last = block[-1]
+        next_label = blocks[i + 1][0] if i + 1 < len(blocks) else None
+        targets: list[int] = []
+        for insn in block:
+            match insn:
+                case ir.Jump(label=label):
+                    targets.append(block_index[label.name])
+                case ir.CondJump(then_label=then_label, else_label=else_label):
+                    targets.extend(block_index[t.name] for t in (then_label, else_label) if t is not None)
+        if (isinstance(next_label, ir.Label) and not isinstance(last, ir.Jump)
+                and not (isinstance(last, ir.CondJump) and last.then_label and last.else_label)):
+            falls_into.append(next_label)
+            targets.append(i + 1)
+        else:
+            falls_into.append(None)
+        # Visited last, so the first target ends up right after this block
+        successors.append(targets[::-1])
+
+    exit_block = len(blocks) - 1
+    visited = [False] * len(blocks)
+    visited[0] = visited[exit_block] = True
+    postorder: list[int] = []
+    stack = [(0, iter(successors[0]))]
+    while stack:
+        block_id, pending = stack[-1]
+        for successor in pending:
+            if not visited[successor]:
+                visited[successor] = True
+                stack.append((successor, iter(successors[successor])))
+                break
+        else:
+            stack.pop()
+            postorder.append(block_id)
+    order = postorder[::-1]
+    order += [i for i in range(1, exit_block) if not visited[i]]
+    order.append(exit_block)
+
+    result: list[ir.Instruction] = []
+    for position, i in enumerate(order):
+        result += blocks[i]
+        target = falls_into[i]
+        if target is not None and (position + 1 == len(order) or order[position + 1] != i + 1):
+            result.append(ir.Jump(blocks[i][-1].location, target))
+    return result
+
+
+# Built-in operators and functions with the type of their result. The IRVars come from
+# IRVar.get, so they are the same objects as any other IRVar of the same name.
+_GLOBAL_ENTRIES: tuple[tuple[str, tuple[ir.IRVar, Type]], ...] = tuple(
+    (name, (ir.IRVar.get(name), t))
+    for names, t in (
+        (("+", "-", "*", "/", "%", "unary_-"), Int),
+        (("<", "<=", "==", ">=", ">", "!=", "unary_not"), Bool),
+        (("print_int", "print_bool", "read_int"), Unit),
+    )
+    for name in names
+)
+
+GLOBAL_SYMTAB = SymTab(dict(_GLOBAL_ENTRIES))
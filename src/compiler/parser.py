@@ -1,169 +1,187 @@
+from dataclasses import dataclass
 from tokenizer import Token, tokenize, Location
 import astree as ast
-from datatypes import IntType, BoolType, UnitType
+from datatypes import IntType, BoolType, UnitType, Type
 
 
-def parse(tokens: list[Token]) -> ast.Expression:
-    if not tokens:
-        raise Exception("Error: Empty input, no tokens to parse")
-    pos = 0
+# Binary operators with their precedence and result type, lowest precedence first. All of
+# them are left-associative: the right operand is parsed at the operator's own
+# precedence, so a following operator of the same level ends it. Assignment keeps the
+# node's default type.
+_BINARY_OPERATORS: dict[str, tuple[int, Type | None]] = {
+    "=": (1, None),
+    "or": (2, BoolType()),
+    "and": (3, BoolType()),
+    **{op: (4, BoolType()) for op in ("==", "!=")},
+    **{op: (5, BoolType()) for op in ("<", "<=", ">", ">=")},
+    **{op: (6, IntType()) for op in ("+", "-")},
+    **{op: (7, IntType()) for op in ("*", "/", "%")},
+}
 
-    def peek() -> Token:
-        if pos < len(tokens):
-            return tokens[pos]
-        else:
-            return Token(
-                location=tokens[-1].location,
-                type="end",
-                text="",
-            )
-
-    def prev() -> Token:
-        if pos != 0:
-            return tokens[pos - 1]
-
-    def consume(expected: str | list[str] | None = None) -> Token:
-        nonlocal pos
-        token = peek()
-        if isinstance(expected, str) and token.text != expected:
-            raise Exception(f"{token.location}: expected '{expected}'")
-        if isinstance(expected, list) and token.text not in expected:
-            comma_separated = ", ".join(f'"{e}"' for e in expected)
-            raise Exception(f"{token.location}: expected one of: '{comma_separated}'")
-        pos += 1
-        return token
-
-    def parse_int_literal() -> ast.Literal:
-        if peek().type != "int_literal":
-            raise Exception(f"{peek().location}: expected an integer literal")
-        token = consume()
-        if token.text == "true":
-            return ast.Literal(token.location, True, type=BoolType())
-        elif token.text == "false":
-            return ast.Literal(token.location, False, type=BoolType())
-        else:
-            return ast.Literal(token.location, int(token.text), type=IntType())
-
-    def parse_identifier() -> ast.Identifier:
-        if peek().type != "identifier":
-            raise Exception(f"{peek().location}: expected an identifier")
-        token = consume()
-        return ast.Identifier(token.location, token.text)
-
-    def parse_if_expression() -> ast.Expression:
-        token = consume("if")
-        condition = parse_expression()
-        if not isinstance(condition.type, BoolType):
-            raise Exception(f"{token.location}: expected a boolean type for if condition, got {condition.type}")
-        consume("then")
-        then_expr = parse_expression()
-        else_expr = None
-        if peek().text == "else":
-            consume("else")
-            else_expr = parse_expression()
-            if then_expr.type != else_expr.type:
-                raise Exception(f"{then_expr.location}: if-clause branches must have the same type, got {then_expr.type} and {else_expr.type}")
-            return ast.IfExpr(token.location, condition, then_expr, else_expr, type=then_expr.type)
-        else:
-            return ast.IfExpr(token.location, condition, then_expr, else_expr)
+# Type names accepted in a variable declaration's annotation
+_DECLARED_TYPES: dict[str, Type] = {"Int": IntType(), "Bool": BoolType(), "Unit": UnitType()}
 
-    def parse_expression(precedence: int = 0, allowVarDecl: bool = False) -> ast.Expression:
-        """Parse expressions based on operator precedence."""
-        if allowVarDecl and peek().text == "var":
-            return parse_var_decl()
-        left = parse_primary()
-        while True:
-            op = peek().text
-            if op == "=" and precedence < 1:
-                token = consume("=")
-                right = parse_expression(1)
-                left = ast.BinaryOp(token.location, left, op, right)
-            elif op in {"or"} and precedence < 2:
-                token = consume("or")
-                right = parse_expression(2)
-                left = ast.BinaryOp(token.location, left, op, right, type=BoolType())
-            elif op in {"and"} and precedence < 3:
-                token = consume("and")
-                right = parse_expression(3)
-                left = ast.BinaryOp(token.location, left, op, right, type=BoolType())
-            elif op in {"==", "!="} and precedence < 4:
-                token = consume(op)
-                right = parse_expression(4)
-                left = ast.BinaryOp(token.location, left, op, right, type=BoolType())
-            elif op in {"<", "<=", ">", ">="} and precedence < 5:
-                token = consume(op)
-                right = parse_expression(5)
-                left = ast.BinaryOp(token.location, left, op, right, type=BoolType())
-            elif op in {"+", "-"} and precedence < 6:
-                token = consume(op)
-                right = parse_expression(6)
-                left = ast.BinaryOp(token.location, left, op, right, type=IntType())
-            elif op in {"*", "/", "%"} and precedence < 7:
-                token = consume(op)
-                right = parse_expression(7)
-                left = ast.BinaryOp(token.location, left, op, right, type=IntType())
-            else:
-                break
-        return left
-
-    def parse_primary() -> ast.Expression:
-        if peek().text == "{":
-            return parse_block()
-        elif peek().text == "if":
-            return parse_if_expression()
-        elif peek().text == "while":
-            return parse_while()
-        elif peek().text == "(":
-            return parse_parenthesized()
-        elif peek().text == "not":
-            return parse_unary_op("not")
-        elif peek().text == "-":
-            return parse_unary_op("-")
-        elif peek().type == "int_literal":
-            return parse_int_literal()
-        elif peek().type == "identifier":
-            identifier = parse_identifier()
-            if peek().text == "(":
-                return parse_function_call(identifier)
-            return identifier
+
+@dataclass(slots=True)
+class ParserState:
+    """The token list and the read position shared by the parsing functions.
+
+    The list ends with an "end" token that no parsing function consumes, so peeking
+    never runs past it."""
+    tokens: list[Token]
+    pos: int = 0
+    # Text of the most recently consumed token
+    last_text: str = ""
+
+
+def peek(s: ParserState) -> Token:
+    return s.tokens[s.pos]
+
+
+def consume(s: ParserState, expected: str) -> Token:
+    token = s.tokens[s.pos]
+    if token.text != expected:
+        raise Exception(f"{token.location}: expected '{expected}'")
+    s.pos += 1
+    s.last_text = token.text
+    return token
+
+
+def advance(s: ParserState) -> Token:
+    """Consume a token the caller has already checked."""
+    token = s.tokens[s.pos]
+    s.pos += 1
+    s.last_text = token.text
+    return token
+
+
+def parse_int_literal(s: ParserState) -> ast.Literal:
+    if peek(s).type != "int_literal":
+        raise Exception(f"{peek(s).location}: expected an integer literal")
+    token = advance(s)
+    if token.text == "true":
+        return ast.Literal(token.location, True, type=BoolType())
+    elif token.text == "false":
+        return ast.Literal(token.location, False, type=BoolType())
+    else:
+        return ast.Literal(token.location, int(token.text), type=IntType())
+
+
+def parse_identifier(s: ParserState) -> ast.Identifier:
+    if peek(s).type != "identifier":
+        raise Exception(f"{peek(s).location}: expected an identifier")
+    token = advance(s)
+    return ast.Identifier(token.location, token.text)
+
+
+def parse_if_expression(s: ParserState) -> ast.Expression:
+    token = consume(s, "if")
+    condition = parse_expression(s)
+    if not isinstance(condition.type, BoolType):
+        raise Exception(f"{token.location}: expected a boolean type for if condition, got {condition.type}")
+    consume(s, "then")
+    then_expr = parse_expression(s)
+    else_expr = None
+    if peek(s).text == "else":
+        consume(s, "else")
+        else_expr = parse_expression(s)
+        if then_expr.type != else_expr.type:
+            raise Exception(f"{then_expr.location}: if-clause branches must have the same type, got {then_expr.type} and {else_expr.type}")
+        return ast.IfExpr(token.location, condition, then_expr, else_expr, type=then_expr.type)
+    else:
+        return ast.IfExpr(token.location, condition, then_expr, else_expr)
+
+
+def parse_expression(s: ParserState, precedence: int = 0, allowVarDecl: bool = False) -> ast.Expression:
+    """Parse expressions based on operator precedence."""
+    if allowVarDecl and peek(s).text == "var":
+        return parse_var_decl(s)
+    left = parse_primary(s)
+    while True:
+        token = peek(s)
+        operator = _BINARY_OPERATORS.get(token.text)
+        if operator is None or operator[0] <= precedence:
+            break
+        op_precedence, result_type = operator
+        advance(s)
+        right = parse_expression(s, op_precedence)
+        if result_type is None:
+            left = ast.BinaryOp(token.location, left, token.text, right)
         else:
-            raise Exception(f"{peek().location}: expected '(', an integer literal or an identifier")
-
-    def parse_while() -> ast.While:
-        token = consume("while")
-        condition = parse_expression()
-        if not isinstance(condition.type, BoolType):
-            raise Exception(f"{token.location}: expected a boolean for while condition, got {condition.type}")
-        consume("do")
-        consume("{")
-        statements = []
-        while peek().text != "}":
-            expr = parse_expression(allowVarDecl=True)
-            statements.append(expr)
-            if peek().text == ";":
-                consume(";")
-            elif peek().text != "}" and prev().text != "}":
-                raise Exception(f"{peek().location}: expected ';' or '}}'")
-        consume("}")
-        return ast.While(token.location, condition, statements)
-
-    def parse_block() -> ast.Block:
-        token = consume("{")
-        statements = []
-        while peek().text != "}":
-            expr = parse_expression(allowVarDecl=True)
-            statements.append(expr)
-            if peek().text == ";":
-                consume(";")
-            elif peek().text != "}" and prev().text != "}":
-                raise Exception(f"{peek().location}: expected ';' or '}}'")
-        final_semi_colon = False if prev().text != ";" else True
-        consume("}")
-        result_expr = final_statement(statements[-1], False) if (not final_semi_colon and statements) else None
-        block_type = result_expr.type if result_expr is not None else UnitType
-        return ast.Block(token.location, statements, result_expr, type=block_type)
-
-    def final_statement(stmt: ast.Expression, final_flag: bool) -> ast.Expression | None:
+            left = ast.BinaryOp(token.location, left, token.text, right, type=result_type)
+    return left
+
+
+def parse_primary(s: ParserState) -> ast.Expression:
+    token = peek(s)
+    text = token.text
+    if text == "{":
+        return parse_block(s)
+    elif text == "if":
+        return parse_if_expression(s)
+    elif text == "while":
+        return parse_while(s)
+    elif text == "(":
+        return parse_parenthesized(s)
+    elif text == "not":
+        return parse_unary_op(s, "not")
+    elif text == "-":
+        return parse_unary_op(s, "-")
+    elif token.type == "int_literal":
+        return parse_int_literal(s)
+    elif token.type == "identifier":
+        identifier = parse_identifier(s)
+        if peek(s).text == "(":
+            return parse_function_call(s, identifier)
+        return identifier
+    else:
+        raise Exception(f"{token.location}: expected '(', an integer literal or an identifier")
+
+
+def parse_while(s: ParserState) -> ast.While:
+    token = consume(s, "while")
+    condition = parse_expression(s)
+    if not isinstance(condition.type, BoolType):
+        raise Exception(f"{token.location}: expected a boolean for while condition, got {condition.type}")
+    consume(s, "do")
+    consume(s, "{")
+    statements: list[ast.Expression] = []
+    append = statements.append
+    while peek(s).text != "}":
+        expr = parse_expression(s, allowVarDecl=True)
+        append(expr)
+        tail = peek(s)
+        if tail.text == ";":
+            consume(s, ";")
+        elif tail.text != "}" and s.last_text != "}":
+            raise Exception(f"{tail.location}: expected ';' or '}}'")
+    consume(s, "}")
+    return ast.While(token.location, condition, statements)
+
+
+def parse_block(s: ParserState) -> ast.Block:
+    token = consume(s, "{")
+    statements: list[ast.Expression] = []
+    append = statements.append
+    while peek(s).text != "}":
+        expr = parse_expression(s, allowVarDecl=True)
+        append(expr)
+        tail = peek(s)
+        if tail.text == ";":
+            consume(s, ";")
+        elif tail.text != "}" and s.last_text != "}":
+            raise Exception(f"{tail.location}: expected ';' or '}}'")
+    final_semi_colon = False if s.last_text != ";" else True
+    consume(s, "}")
+    result_expr = final_statement(statements[-1], False) if (not final_semi_colon and statements) else None
+    block_type = result_expr.type if result_expr is not None else UnitType
+    return ast.Block(token.location, statements, result_expr, type=block_type)
+
+
+def final_statement(stmt: ast.Expression, final_flag: bool) -> ast.Expression | None:
+    # Assignments and blocks hand the result over to their right-hand side or result
+    # expression; those are followed in a loop rather than by recursion
+    while True:
         loc = stmt.location
         match stmt:
             case ast.Literal(type=type):
@@ -180,8 +198,9 @@ def parse(tokens: list[Token]) -> ast.Expression:
                     return ast.Call(loc, "print_int", [stmt]) if final_flag else stmt
                 elif isinstance(type, BoolType):
                     return ast.Call(loc, "print_bool", [stmt]) if final_flag else stmt
-                else:
-                    return final_statement(right, True) if final_flag else right
+                elif not final_flag:
+                    return right
+                stmt = right
             case ast.IfExpr(else_expr=else_expr, type=type):
                 if else_expr is None:
                     return None
@@ -190,6 +209,7 @@ def parse(tokens: list[Token]) -> ast.Expression:
                         return ast.Call(loc, "print_int", [stmt]) if final_flag else stmt
                     elif isinstance(type, BoolType):
                         return ast.Call(loc, "print_bool", [stmt]) if final_flag else stmt
+                    return None
             case ast.Call(function=function):
                 if function == "read_int":
                     return ast.Call(loc, "print_int", [stmt]) if final_flag else stmt
@@ -201,10 +221,9 @@ def parse(tokens: list[Token]) -> ast.Expression:
                 else:
                     return ast.Call(loc, "print_bool", [stmt]) if final_flag else stmt
             case ast.Block(result_expr=result_expr):
-                if result_expr is not None:
-                    return final_statement(result_expr, final_flag)
-                else:
+                if result_expr is None:
                     return None
+                stmt = result_expr
             case ast.VarDecl():
                 return None
             case ast.While():
@@ -212,82 +231,88 @@ def parse(tokens: list[Token]) -> ast.Expression:
             case _:
                 raise Exception(f"{stmt.location}: Unknown AST node {stmt}")
 
-    def parse_unary_op(op: str) -> ast.UnaryOp:
-        token = consume(op)
-        expr = parse_expression(8)
-        if op == "-":
-            return ast.UnaryOp(token.location, op, expr, type=IntType())
-        elif op == "not":
-            return ast.UnaryOp(token.location, op, expr, type=BoolType())
-        else:
-            raise Exception(f"{peek().location}: Unknown unary operator, expected 'not' or '{op}'")
-
-    def parse_function_call(identifier: ast.Identifier) -> ast.Call:
-        token = consume("(")
-        arguments = []
-        if peek().text != ")":
-            while True:
-                arguments.append(parse_expression())
-                if peek().text == ",":
-                    consume(",")
-                else:
-                    break
-        consume(")")
-        return ast.Call(token.location, identifier.name, arguments)
-
-    def parse_parenthesized() -> ast.Expression:
-        consume("(")
-        expr = parse_expression()
-        consume(")")
-        return expr
-
-    def parse_var_decl() -> ast.VarDecl:
-        """Parse a variable declaration: var x = expr"""
-        token = consume("var")
-        if peek().type != "identifier":
-            raise Exception(f"{peek().location}: expected an identifier after 'var'")
-        name = consume().text
-        if peek().text == "=":
-            consume("=")
-            initializer = parse_expression()
-            return ast.VarDecl(token.location, name, initializer, type=initializer.type)
-        elif peek().text in {"Int", "Bool", "Unit"}:
-            datatype = peek().text
-            consume(datatype)
-            if peek().text != "=":
-                raise Exception(f"{peek().location}: expected '=' after variable")
-            consume("=")
-            initializer = parse_expression()
-            if datatype == "Int":
-                return ast.VarDecl(token.location, name, initializer, type=IntType())
-            elif datatype == "Bool":
-                return ast.VarDecl(token.location, name, initializer, type=BoolType())
+
+def parse_unary_op(s: ParserState, op: str) -> ast.UnaryOp:
+    token = consume(s, op)
+    expr = parse_expression(s, 8)
+    if op == "-":
+        return ast.UnaryOp(token.location, op, expr, type=IntType())
+    elif op == "not":
+        return ast.UnaryOp(token.location, op, expr, type=BoolType())
+    else:
+        raise Exception(f"{peek(s).location}: Unknown unary operator, expected 'not' or '{op}'")
+
+
+def parse_function_call(s: ParserState, identifier: ast.Identifier) -> ast.Call:
+    token = consume(s, "(")
+    arguments = []
+    if peek(s).text != ")":
+        while True:
+            arguments.append(parse_expression(s))
+            if peek(s).text == ",":
+                consume(s, ",")
             else:
-                return ast.VarDecl(token.location, name, initializer, type=UnitType())
-        else:
-            raise Exception(f"{peek().location}: Expected data type or = after variable")
-
-    def parse_program() -> ast.Program:
-        expressions = []
-        while peek().type != "end":
-            expr = parse_expression(allowVarDecl=True)
-            expressions.append(expr)
-            if prev().text == "}":
-                if peek().text == ";":
-                    consume(";")
-            elif peek().text == ";":
-                consume(";")
-            elif peek().type != "end":
-                raise Exception(f"{peek().location}: expected ';'")
-        location = Location(0, 0)
-        if prev().text != ";":
-            final_expr = final_statement(expressions[-1], True)
-            return ast.Program(location, expressions, final_expr)
-        return ast.Program(location, expressions)
-
-    result = parse_program()
-    if pos < len(tokens):
-        raise Exception(f"{tokens[pos].location}: Unexpected token '{tokens[pos].text}' at the end of input")
+                break
+    consume(s, ")")
+    return ast.Call(token.location, identifier.name, arguments)
+
+
+def parse_parenthesized(s: ParserState) -> ast.Expression:
+    consume(s, "(")
+    expr = parse_expression(s)
+    consume(s, ")")
+    return expr
+
+
+def parse_var_decl(s: ParserState) -> ast.VarDecl:
+    """Parse a variable declaration: var x = expr"""
+    token = consume(s, "var")
+    if peek(s).type != "identifier":
+        raise Exception(f"{peek(s).location}: expected an identifier after 'var'")
+    name = advance(s).text
+    if peek(s).text == "=":
+        consume(s, "=")
+        initializer = parse_expression(s)
+        return ast.VarDecl(token.location, name, initializer, type=initializer.type)
+    elif peek(s).text in _DECLARED_TYPES:
+        datatype = _DECLARED_TYPES[advance(s).text]
+        if peek(s).text != "=":
+            raise Exception(f"{peek(s).location}: expected '=' after variable")
+        consume(s, "=")
+        initializer = parse_expression(s)
+        return ast.VarDecl(token.location, name, initializer, type=datatype)
+    else:
+        raise Exception(f"{peek(s).location}: Expected data type or = after variable")
+
+
+def parse_program(s: ParserState) -> ast.Program:
+    expressions: list[ast.Expression] = []
+    append = expressions.append
+    while peek(s).type != "end":
+        expr = parse_expression(s, allowVarDecl=True)
+        append(expr)
+        tail = peek(s)
+        if s.last_text == "}":
+            if tail.text == ";":
+                consume(s, ";")
+        elif tail.text == ";":
+            consume(s, ";")
+        elif tail.type != "end":
+            raise Exception(f"{tail.location}: expected ';'")
+    location = Location(0, 0)
+    if s.last_text != ";":
+        final_expr = final_statement(expressions[-1], True)
+        return ast.Program(location, expressions, final_expr)
+    return ast.Program(location, expressions)
+
+
+def parse(tokens: list[Token]) -> ast.Expression:
+    if not tokens:
+        raise Exception("Error: Empty input, no tokens to parse")
+    s = ParserState(tokens + [Token(location=tokens[-1].location, type="end", text="")])
+    result = parse_program(s)
+    if s.pos < len(tokens):
+        raise Exception(f"{tokens[s.pos].location}: Unexpected token '{tokens[s.pos].text}' at the end of input")
 
     return result
 
@@ -298,4 +323,4 @@ def parser(code: str) -> ast.Expression:
 
 
 #print(parser("""var x: Int = 3;
-#x + 1"""))
\ No newline at end of file
+#x + 1"""))
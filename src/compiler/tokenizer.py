@@ -1,48 +1,63 @@
 import re
+import sys
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class Location:
     line: int
     column: int
 
 
-@dataclass
+@dataclass(slots=True)
 class Token:
     text: str
     type: str
     location: Location
 
 
+# One pass over the whole source. Comments run to the end of their line and are
+# tried first so that "//" is not read as two division operators. Characters that
+# match no alternative are skipped, and the named group that matched decides the
+# token type.
+_TOKEN_PATTERN = re.compile(
+    r'(?P<comment>//.*|#.*)'
+    r'|(?P<newline>\n)'
+    r'|(?P<identifier>\b[_a-zA-Z][_a-zA-Z0-9]*\b)'
+    r'|(?P<int_literal>\b\d+\b)'
+    r'|(?P<operator>==|!=|<=|>=|%|<|>|=|\+|\-|\*|/)'
+    r'|(?P<punctuation>[(){},;])'
+    r'|(?P<other>\.)'
+)
+
+
 def tokenize(source_code: str) -> list[Token]:
-    token_pattern = re.compile(
-        r'\b[_a-zA-Z][_a-zA-Z0-9]*\b'  
-        r'|\b\d+\b'               
-        r'|==|!=|<=|>=|%|<|>|=|\+|\-|\*|/'
-        r'|[(){}.,;]'
-    )
-    comment_pattern = re.compile(r'//.*|#.*')
-    tokens = []
-    lines = source_code.split('\n')
-
-    for lineNumber, line in enumerate(lines, start=1):
-        line = comment_pattern.sub('', line)
-        for match in token_pattern.finditer(line):
-            text = match.group()
-            column = match.start() + 1
-            if text.isdigit() or text == "true" or text == "false":
+    tokens: list[Token] = []
+    append = tokens.append
+    lineNumber = 1
+    line_start = 0
+
+    for match in _TOKEN_PATTERN.finditer(source_code):
+        type = match.lastgroup
+        assert type is not None  # every alternative is a named group
+        if type == 'comment':
+            continue
+        if type == 'newline':
+            lineNumber += 1
+            line_start = match.end()
+            continue
+        text = match.group()
+        if type == 'identifier':
+            if text == "true" or text == "false":
                 type = 'int_literal'
-            elif re.fullmatch(r'[_a-zA-Z][_a-zA-Z0-9]*', text):
-                type = 'identifier'
-            elif text in {'+', '-', '*', '/', '%', '=', '==', '!=', '<', '<=', '>', '>='}:
-                type = 'operator'
-            elif text in {'(', ')', '{', '}', ',', ';'}:
-                type = 'punctuation'
             else:
-                type = 'other'
-
-            location = Location(lineNumber, column)
-            tokens.append(Token(text, type, location))
+                # Interned so that comparisons against operator and keyword
+                # literals succeed on the identity check
+                text = sys.intern(text)
+        elif type == 'operator':
+            text = sys.intern(text)
+
+        location = Location(lineNumber, match.start() - line_start + 1)
+        append(Token(text, type, location))
 
     return tokens
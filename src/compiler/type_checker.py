@@ -1,129 +1,175 @@
 import astree as ast
 from datatypes import Int, Bool, Unit, Type, FunType
-from typing import Optional
+from typing import Any, Callable, Optional
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class TypeSymTab:
     locals: dict[str, Type]
     parent: Optional["TypeSymTab"] = None
 
     def lookup(self, name: str) -> Type:
-        if name in self.locals:
-            return self.locals[name]
-        if self.parent is not None:
-            return self.parent.lookup(name)
+        table: TypeSymTab | None = self
+        while table is not None:
+            found = table.locals.get(name)
+            if found is not None:
+                return found
+            table = table.parent
         raise TypeError(f"Unbound variable {name}")
 
 
 built_in_types = TypeSymTab({
-    "+": FunType([Int, Int], Int),
-    "-": FunType([Int, Int], Int),
-    "*": FunType([Int, Int], Int),
-    "/": FunType([Int, Int], Int),
-    "%": FunType([Int, Int], Int),
-    "and": FunType([Bool, Bool], Bool),
-    "or": FunType([Bool, Bool], Bool),
-    "<": FunType([Int, Int], Bool),
-    ">": FunType([Int, Int], Bool),
-    "<=": FunType([Int, Int], Bool),
-    ">=": FunType([Int, Int], Bool),
-    "print_int": FunType([Int], Unit),
-    "print_bool": FunType([Bool], Unit),
-    "read_int": FunType([Int], Unit),
+    "+": FunType((Int, Int), Int),
+    "-": FunType((Int, Int), Int),
+    "*": FunType((Int, Int), Int),
+    "/": FunType((Int, Int), Int),
+    "%": FunType((Int, Int), Int),
+    "and": FunType((Bool, Bool), Bool),
+    "or": FunType((Bool, Bool), Bool),
+    "<": FunType((Int, Int), Bool),
+    ">": FunType((Int, Int), Bool),
+    "<=": FunType((Int, Int), Bool),
+    ">=": FunType((Int, Int), Bool),
+    "print_int": FunType((Int,), Unit),
+    "print_bool": FunType((Bool,), Unit),
+    "read_int": FunType((), Int),
 })
 
 
+def _typecheck_literal(node: ast.Literal, sym_tab: TypeSymTab) -> Type:
+    value = node.value
+    # bool is a subclass of int, so it has to be tested first
+    if isinstance(value, bool):
+        return Bool
+    elif isinstance(value, int):
+        return Int
+    else:
+        raise TypeError(f"Unsupported literal type: {type(value)}")
+
+
+def _typecheck_binary_op(node: ast.BinaryOp, sym_tab: TypeSymTab) -> Type:
+    op = node.op
+    if op == "==" or op == "!=":
+        t1 = typecheck(node.left, sym_tab)
+        t2 = typecheck(node.right, sym_tab)
+        # Int, Bool and Unit are singletons and function types are interned, so
+        # types are compared by identity throughout
+        if t1 is not t2:
+            raise TypeError(f"{op} requires two operands of the same type, received {t1} and {t2}")
+        node.type = Bool
+        return node.type
+    elif op not in built_in_types.locals:
+        raise TypeError(f"Unknown operator {op}")
+    func_type = built_in_types.locals[op]
+    t1 = typecheck(node.left, sym_tab)
+    t2 = typecheck(node.right, sym_tab)
+    if (t1, t2) != func_type.param_types:
+        raise TypeError(f"Operator {op} expects {func_type.param_types}, got {t1} and {t2}")
+    node.type = func_type.return_type
+    return node.type
+
+
+def _typecheck_call(node: ast.Call, sym_tab: TypeSymTab) -> Type:
+    function = node.function
+    func_type = sym_tab.lookup(function)
+    if not isinstance(func_type, FunType):
+        raise TypeError(f"{function} is not callable, got {func_type}")
+    arg_types = tuple([typecheck(arg, sym_tab) for arg in node.arguments])
+    if arg_types != func_type.param_types:
+        raise TypeError(f"Function expects {func_type.param_types}, got {arg_types}")
+    node.type = func_type.return_type
+    return node.type
+
+
+def _typecheck_identifier(node: ast.Identifier, sym_tab: TypeSymTab) -> Type:
+    node.type = sym_tab.lookup(node.name)
+    return node.type
+
+
+def _typecheck_var_decl(node: ast.VarDecl, sym_tab: TypeSymTab) -> Type:
+    name = node.name
+    init_type = typecheck(node.initializer, sym_tab)
+    if name in sym_tab.locals:
+        raise TypeError(f"Variable {name} already declared")
+    # The parser records the declared type, or its own guess for an undeclared one;
+    # nodes it could not type still hold the default type class
+    datatype = node.type
+    if isinstance(datatype, Type):
+        if datatype is not init_type:
+            raise TypeError(f"Variable {name} expects {datatype}, got {init_type}")
+    sym_tab.locals[name] = init_type
+    node.type = Unit
+    return node.type
+
+
+def _typecheck_unary_op(node: ast.UnaryOp, sym_tab: TypeSymTab) -> Type:
+    op = node.op
+    op_type = typecheck(node.expr, sym_tab)
+    if op == "-":
+        if op_type is not Int:
+            raise TypeError(f"Unary '-' expects Int, got {op_type}")
+        node.type = Int
+        return node.type
+    elif op == "not":
+        if op_type is not Bool:
+            raise TypeError(f"Unary 'not' expects Bool, got {op_type}")
+        node.type = Bool
+        return node.type
+    else:
+        raise TypeError(f"Unknown unary operator {op}")
+
+
+def _typecheck_block(node: ast.Block, sym_tab: TypeSymTab) -> Type:
+    new_sym_tab = TypeSymTab({}, sym_tab)
+    result_type: Type = Unit
+    for statement in node.statements:
+        result_type = typecheck(statement, new_sym_tab)
+    node.type = result_type
+    return node.type
+
+
+def _typecheck_if_expr(node: ast.IfExpr, sym_tab: TypeSymTab) -> Type:
+    cond_type = typecheck(node.condition, sym_tab)
+    if cond_type is not Bool:
+        raise TypeError(f"If condition must be Bool, got {cond_type}")
+    then_type = typecheck(node.then_expr, sym_tab)
+    if node.else_expr is not None:
+        else_type = typecheck(node.else_expr, sym_tab)
+        if then_type is not else_type:
+            raise TypeError(f"If branches must have the same type, got {then_type} and {else_type}")
+        node.type = then_type
+    else:
+        node.type = Unit
+    return node.type
+
+
+def _typecheck_while(node: ast.While, sym_tab: TypeSymTab) -> Type:
+    cond_type = typecheck(node.condition, sym_tab)
+    if cond_type is not Bool:
+        raise TypeError(f"If condition must be Bool, got {cond_type}")
+    for statement in node.statements:
+        typecheck(statement, sym_tab)
+    node.type = Unit
+    return node.type
+
+
+# Checks each node class with one dict lookup rather than probing the classes in turn
+_HANDLERS: dict[type, Callable[[Any, TypeSymTab], Type]] = {
+    ast.Literal: _typecheck_literal,
+    ast.BinaryOp: _typecheck_binary_op,
+    ast.Call: _typecheck_call,
+    ast.Identifier: _typecheck_identifier,
+    ast.VarDecl: _typecheck_var_decl,
+    ast.UnaryOp: _typecheck_unary_op,
+    ast.Block: _typecheck_block,
+    ast.IfExpr: _typecheck_if_expr,
+    ast.While: _typecheck_while,
+}
+
+
 def typecheck(node: ast.Expression, sym_tab: TypeSymTab) -> Type:
-    match node:
-        case ast.Literal(value):
-            if isinstance(value, int):
-                return Int
-            elif isinstance(value, bool):
-                return Bool
-            else:
-                raise TypeError(f"Unsupported literal type: {type(value)}")
-        case ast.BinaryOp(left, op, right):
-            if op == "==" or op == "!=":
-                t1 = typecheck(left, sym_tab)
-                t2 = typecheck(right, sym_tab)
-                if t1 != t2:
-                    raise TypeError(f"{op} requires two operands of the same type, received {t1} and {t2}")
-                node.type = t1
-                return node.type
-            elif op not in built_in_types:
-                raise TypeError(f"Unknown operator {op}")
-            func_type = built_in_types.locals[op]
-            t1 = typecheck(left, sym_tab)
-            t2 = typecheck(right, sym_tab)
-            if [t1, t2] != func_type.param_types:
-                raise TypeError(f"Operator {op} expects {func_type.param_types}, got {t1} and {t2}")
-            node.type = func_type.return_type
-            return node.type
-        case ast.Call(function, arguments):
-            func_type = typecheck(function, sym_tab)
-            if not isinstance(func_type, FunType):
-                raise TypeError(f"{function} is not callable, got {func_type}")
-            arg_types = [typecheck(arg, sym_tab) for arg in arguments]
-            if arg_types != func_type.param_types:
-                raise TypeError(f"Function expects {func_type.param_types}, got {arg_types}")
-            node.type = func_type.return_type
-            return node.type
-        case ast.Identifier(name):
-            node.type = sym_tab.lookup(name)
-            return node.type
-        case ast.VarDecl(name, initializer, datatype):
-            init_type = typecheck(initializer, sym_tab)
-            if name in sym_tab.locals:
-                raise TypeError(f"Variable {name} already declared")
-            if datatype is not None:
-                if datatype != init_type:
-                    raise TypeError(f"Variable {name} expects {datatype}, got {init_type}")
-            sym_tab.locals[name] = init_type
-            node.type = Unit
-            return node.type
-        case ast.UnaryOp(op, expr):
-            op_type = typecheck(expr, sym_tab)
-            if op == "-":
-                if op_type != Int:
-                    raise TypeError(f"Unary '-' expects Int, got {op_type}")
-                node.type = Int
-                return node.type
-            elif op == "not":
-                if op_type != Bool:
-                    raise TypeError(f"Unary 'not' expects Bool, got {op_type}")
-                node.type = Bool
-                return node.type
-            else:
-                raise TypeError(f"Unknown unary operator {op}")
-        case ast.Block(statements, result_expr):
-            new_sym_tab = TypeSymTab({}, sym_tab)
-            result_type = Unit
-            for statement in statements:
-                result_type = typecheck(statement, new_sym_tab)
-            node.type = result_type
-            return node.type
-        case ast.IfExpr(condition, then_expr, else_expr):
-            cond_type = typecheck(condition, sym_tab)
-            if cond_type != Bool:
-                raise TypeError(f"If condition must be Bool, got {cond_type}")
-            then_type = typecheck(then_expr, sym_tab)
-            if else_expr is not None:
-                else_type = typecheck(else_expr, sym_tab)
-                if then_type != else_type:
-                    raise TypeError(f"If branches must have the same type, got {then_type} and {else_type}")
-                node.type = then_expr
-            else:
-                node.type = Unit
-            return node.type
-        case ast.While(condition, statements):
-            cond_type = typecheck(condition, sym_tab)
-            if cond_type != Bool:
-                raise TypeError(f"If condition must be Bool, got {cond_type}")
-            for statement in statements:
-                typecheck(statement, sym_tab)
-            node.type = Unit
-            return node.type
-        case _:
-            raise TypeError(f"Unsupported AST node {node}")
+    handler = _HANDLERS.get(type(node))
+    if handler is None:
+        raise TypeError(f"Unsupported AST node {node}")
+    return handler(node, sym_tab)
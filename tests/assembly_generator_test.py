@@ -0,0 +1,114 @@
+import io
+import re
+import pytest
+from ir import IRVar, Instruction, Label, LoadIntConst, Copy, Call, Jump, CondJump
+from assembly_generator import Locals, generate_assembly, write_assembly, _live_intervals
+from instrinsics import all_intrinsics
+from tokenizer import Location
+
+L = Location(0, 0)
+
+
+def var(name: str) -> IRVar:
+    return IRVar.get(name)
+
+
+def test_value_live_across_back_edge_keeps_its_location() -> None:
+    # `x` is last read at the top of the loop, but the back edge brings
+    # control back there, so `t` must not reuse its location
+    start, end = Label(L, "loop_start"), Label(L, "loop_end")
+    instructions: list[Instruction] = [
+        LoadIntConst(L, 3, var("x")),
+        start,
+        CondJump(L, var("x"), None, end),
+        LoadIntConst(L, 1, var("t")),
+        Call(L, var("print_int"), [var("t")], var("u")),
+        Jump(L, start),
+        end,
+    ]
+    intervals = _live_intervals(instructions)
+    assert intervals[var("x")] == [0, 5]
+    locals = Locals([var("x"), var("t"), var("u")], instructions)
+    assert locals.get_ref(var("x")) != locals.get_ref(var("t"))
+    assert locals.get_ref(var("x")) != locals.get_ref(var("u"))
+
+
+def test_more_live_values_than_registers_spill_to_stack() -> None:
+    names = [var(f"s{i}") for i in range(7)]
+    instructions: list[Instruction] = [LoadIntConst(L, i, v) for i, v in enumerate(names)]
+    instructions += [Copy(L, v, v) for v in names]
+    locals = Locals(names, instructions)
+    refs = [locals.get_ref(v) for v in names]
+    assert len(set(refs)) == len(refs)
+    assert sum(ref.startswith("%") for ref in refs) == 5
+    assert sorted(ref for ref in refs if not ref.startswith("%")) == ["-16(%rbp)", "-8(%rbp)"]
+    assert len(locals.saved_registers()) == 5
+
+
+def test_stack_aligned_at_calls() -> None:
+    # At `main` entry %rsp is 8 mod 16; `pushq %rbp` makes it 0 mod 16,
+    # so the stack space plus the pushed registers must be a multiple of 16
+    for count in range(9):
+        names = [var(f"a{i}") for i in range(count)]
+        instructions: list[Instruction] = [LoadIntConst(L, i, v) for i, v in enumerate(names)]
+        instructions += [Call(L, var("print_int"), [v], v) for v in names]
+        asm = generate_assembly(instructions, names)
+        match = re.search(r"subq \$(\d+), %rsp\n((?:pushq %r\w+\n)*)", asm)
+        assert match is not None
+        pushed = match[2].count("pushq")
+        assert (int(match[1]) + 8 * pushed) % 16 == 0
+        assert asm.count("popq %r") == pushed + 1
+
+
+def test_cond_jump_reuses_comparison_flags() -> None:
+    then_label, else_label = Label(L, "then"), Label(L, "else")
+    compare = Call(L, var("<"), [var("a"), var("b")], var("c"), all_intrinsics["<"])
+    asm = generate_assembly(
+        [compare, CondJump(L, var("c"), then_label, else_label), else_label, then_label],
+        [var("a"), var("b"), var("c")],
+    )
+    assert "jl .then\n" in asm
+    assert "jmp .else" not in asm
+    assert "testq" not in asm and "cmpq $0" not in asm
+
+
+def test_cond_jump_inverts_branch_when_then_label_follows() -> None:
+    then_label, else_label = Label(L, "then"), Label(L, "else")
+    compare = Call(L, var("<="), [var("a"), var("b")], var("c"), all_intrinsics["<="])
+    asm = generate_assembly(
+        [compare, CondJump(L, var("c"), then_label, else_label), then_label, else_label],
+        [var("a"), var("b"), var("c")],
+    )
+    assert "jg .else\n" in asm
+    assert "jle" not in asm and "jmp" not in asm
+
+
+def test_cond_jump_after_external_call_tests_the_value() -> None:
+    then_label, else_label = Label(L, "then"), Label(L, "else")
+    asm = generate_assembly(
+        [Call(L, var("read_int"), [], var("c")), CondJump(L, var("c"), then_label, else_label), else_label, then_label],
+        [var("c")],
+    )
+    assert "jne .then\n" in asm
+
+
+def test_call_passes_arguments_in_abi_registers() -> None:
+    asm = generate_assembly(
+        [LoadIntConst(L, 1, var("a")), LoadIntConst(L, 2, var("b")), Call(L, var("f"), [var("a"), var("b")], var("c"))],
+        [var("a"), var("b"), var("c")],
+    )
+    assert re.search(r"movq \S+, %rdi\nmovq \S+, %rsi\ncallq f\n", asm)
+
+
+def test_write_assembly_matches_generate_assembly() -> None:
+    instructions: list[Instruction] = [LoadIntConst(L, 7, var("a")), Call(L, var("print_int"), [var("a")], var("b"))]
+    out = io.BytesIO()
+    write_assembly(instructions, [var("a"), var("b")], out)
+    assert out.getvalue().decode() == generate_assembly(instructions, [var("a"), var("b")])
+
+
+def test_locals_reject_variables_not_built_through_get() -> None:
+    a = var("a")
+    locals = Locals([a], [LoadIntConst(L, 1, a), Copy(L, a, a)])
+    with pytest.raises(AttributeError):
+        locals.get_ref(IRVar("a"))
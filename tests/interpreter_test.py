@@ -0,0 +1,61 @@
+import pytest
+from tokenizer import tokenize
+from parser import parse
+from ir_generator import generate_ir, GLOBAL_SYMTAB
+from interpreter import exec_ir, interpret, resolve_scopes
+
+
+def run_ir(code: str, capsys: pytest.CaptureFixture[str]) -> str:
+    ir_lines, _ = generate_ir(GLOBAL_SYMTAB, parse(tokenize(code)))
+    exec_ir(ir_lines)
+    return capsys.readouterr().out
+
+
+def test_exec_ir_while_loop(capsys: pytest.CaptureFixture[str]) -> None:
+    assert run_ir("var x = 0; while x < 3 do { x = x + 1; print_int(x) }", capsys) == "1\n2\n3\n"
+
+
+def test_exec_ir_arithmetic(capsys: pytest.CaptureFixture[str]) -> None:
+    assert run_ir("var a = 7; var b = a * 3 - 4 % 3; print_int(b)", capsys) == "20\n"
+
+
+def test_exec_ir_division_truncates_towards_zero(capsys: pytest.CaptureFixture[str]) -> None:
+    assert run_ir("var a = 0 - 7; print_int(a / 2); print_int(a % 2)", capsys) == "-3\n-1\n"
+
+
+def test_exec_ir_comparisons(capsys: pytest.CaptureFixture[str]) -> None:
+    assert run_ir("var x = 4; print_bool(x >= 4); print_bool(x > 4)", capsys) == "true\nfalse\n"
+
+
+def test_exec_ir_short_circuit(capsys: pytest.CaptureFixture[str]) -> None:
+    assert run_ir("var a = false; print_bool(a or false); print_bool(a and true)", capsys) == "false\nfalse\n"
+
+
+def run_ast(code: str, capsys: pytest.CaptureFixture[str]) -> str:
+    node = parse(tokenize(code))
+    resolve_scopes(node)
+    interpret(node, [])
+    return capsys.readouterr().out
+
+
+def test_interpret_block_scopes(capsys: pytest.CaptureFixture[str]) -> None:
+    code = "var x = 1; { var x = 5; var y = x; print_int(y) }; var z = 2; print_int(x); print_int(z)"
+    assert run_ast(code, capsys) == "5\n1\n2\n"
+
+
+def test_interpret_undefined_variable() -> None:
+    node = parse(tokenize("{ var y = 1 }; print_int(y)"))
+    resolve_scopes(node)
+    with pytest.raises(NameError):
+        interpret(node, [])
+
+
+def test_interpret_short_circuit(capsys: pytest.CaptureFixture[str]) -> None:
+    code = "var f = false; var t = true; var a = f or f; var b = f or t; var c = t and f; var d = f and t; " \
+        "print_bool(a); print_bool(b); print_bool(c); print_bool(d)"
+    assert run_ast(code, capsys) == "False\nTrue\nFalse\nFalse\n"
+
+
+def test_exec_ir_unit_valued_if_else(capsys: pytest.CaptureFixture[str]) -> None:
+    code = "var a = 1; if a < 2 then { a = 3; } else { a = 4; }; print_int(a)"
+    assert run_ir(code, capsys) == "3\n"
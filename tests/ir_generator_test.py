@@ -0,0 +1,90 @@
+import pytest
+from ir import IRVar, Instruction, Label, LoadIntConst, Copy, Jump, CondJump, Call
+from ir_generator import copy_propagate, layout_blocks, generate_ir, GLOBAL_SYMTAB, ScopeStack
+from datatypes import Int, Bool
+from interpreter import exec_ir
+from parser import parse
+from tokenizer import Location, tokenize
+
+L = Location(0, 0)
+
+
+def test_layout_places_then_branch_after_cond_jump_and_keeps_exit_last() -> None:
+    then_label, else_label, end_label = Label(L, "then"), Label(L, "else"), Label(L, "end")
+    x = IRVar.get("x")
+    entry: list[Instruction] = [LoadIntConst(L, 1, x), CondJump(L, x, then_label, else_label)]
+    else_block: list[Instruction] = [else_label, Copy(L, x, x), Jump(L, end_label)]
+    then_block: list[Instruction] = [then_label, Copy(L, x, x)]
+    exit_block: list[Instruction] = [end_label, Copy(L, x, x)]
+    laid_out = layout_blocks(entry + else_block + then_block + exit_block)
+    # The then block used to fall through into the exit block, which is now an explicit jump
+    assert laid_out == entry + then_block + [Jump(L, end_label)] + else_block + exit_block
+
+
+def test_copy_propagate_folds_single_use_temporary() -> None:
+    x, y, z = IRVar.get("x"), IRVar.get("y"), IRVar.get("z")
+    instructions: list[Instruction] = [LoadIntConst(L, 1, x), Copy(L, x, y), LoadIntConst(L, 2, z), Copy(L, z, y), Copy(L, z, y)]
+    folded, variables = copy_propagate(instructions, [x, y, z])
+    # `z` is read twice, so its copies stay
+    assert folded == [LoadIntConst(L, 1, y), LoadIntConst(L, 2, z), Copy(L, z, y), Copy(L, z, y)]
+    assert variables == [y, z]
+
+
+def test_block_without_declarations_shares_enclosing_scope() -> None:
+    # The temporary holding `a < b` is visible to the `and`, which used to reject it as Unit
+    source = "var a = 1; var b = 2; var c = true; var d = { a < b } and c; print_bool(d)"
+    instructions, _ = generate_ir(GLOBAL_SYMTAB, parse(tokenize(source)))
+    assert any(isinstance(insn, CondJump) for insn in instructions)
+
+
+def test_layout_keeps_fall_through_when_order_is_unchanged() -> None:
+    loop_label, end_label = Label(L, "loop"), Label(L, "end")
+    x = IRVar.get("x")
+    instructions: list[Instruction] = [
+        LoadIntConst(L, 1, x), loop_label, CondJump(L, x, end_label, loop_label), end_label, Copy(L, x, x)]
+    # The entry block still falls into `loop`, so no jump is added for it
+    assert layout_blocks(instructions) == instructions
+
+
+def test_scope_stack_restores_shadowed_names_on_exit() -> None:
+    scopes = ScopeStack(GLOBAL_SYMTAB)
+    outer, inner = (IRVar.get("x"), Int), (IRVar.get("y"), Bool)
+    scopes.declare("a", outer)
+    scopes.enter_scope()
+    assert scopes.local_lookup("a") is None and scopes.lookup("a") == outer
+    scopes.declare("a", inner)
+    assert scopes.lookup("a") == inner
+    scopes.exit_scope()
+    assert scopes.lookup("a") == outer
+    # Globals are visible but not local to the program scope
+    assert scopes.lookup("+") is not None and scopes.local_lookup("+") is None
+
+
+def test_operand_typed_from_its_variable_inside_a_nested_scope() -> None:
+    # `not` used to look the block's result up by name in the outer scope and find nothing
+    source = "var q = true; print_bool(not { var z = 1; q })"
+    instructions, _ = generate_ir(GLOBAL_SYMTAB, parse(tokenize(source)))
+    assert any(isinstance(insn, Call) and insn.fun.name == "unary_not" for insn in instructions)
+
+
+def test_chained_assignment_copies_along_the_chain() -> None:
+    source = "var a = 1; var b = 2; var c = 3; var d = 4; a = b = c = d;"
+    instructions, _ = generate_ir(GLOBAL_SYMTAB, parse(tokenize(source)))
+    load_d, into_b, into_a = instructions[-3:]
+    # Copying d into c is folded into the load of d, then c is copied into b and b into a
+    assert isinstance(load_d, LoadIntConst) and load_d.value == 4
+    assert isinstance(into_b, Copy) and isinstance(into_a, Copy)
+    assert into_b.source == load_d.dest and into_a.source == into_b.dest
+    assert len({load_d.dest, into_b.dest, into_a.dest}) == 3
+
+
+def test_while_declarations_inside_a_block_get_the_block_scope(capsys: pytest.CaptureFixture[str]) -> None:
+    # A loop declares its body's variables in the enclosing scope, so the block has
+    # to open a scope even though it declares nothing directly
+    for source in (
+        "var y = 1; { while false do { var y = 2; } }; print_int(y)",
+        "var y = 1; { if true then while false do { var y = 2; } }; print_int(y)",
+    ):
+        instructions, _ = generate_ir(GLOBAL_SYMTAB, parse(tokenize(source)))
+        exec_ir(instructions)
+        assert capsys.readouterr().out == "1\n"
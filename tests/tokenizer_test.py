@@ -1,2 +1,12 @@
 import builtins
+from tokenizer import tokenize
 print(builtins.__import__('dataclasses'))
+
+
+def test_tokenize_tracks_lines_across_comments() -> None:
+    tokens = tokenize("a // b\n  x #y\n1//2")
+    assert [(t.text, t.type, t.location.line, t.location.column) for t in tokens] == [
+        ("a", "identifier", 1, 1),
+        ("x", "identifier", 2, 3),
+        ("1", "int_literal", 3, 1),
+    ]
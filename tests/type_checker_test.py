@@ -0,0 +1,35 @@
+import pytest
+from tokenizer import tokenize
+from parser import parse
+from type_checker import typecheck, TypeSymTab, built_in_types
+from datatypes import Int, Bool, Unit, Type
+
+
+def check(code: str) -> list[Type]:
+    sym_tab = TypeSymTab({}, built_in_types)
+    return [typecheck(statement, sym_tab) for statement in parse(tokenize(code)).statements]
+
+
+def test_typecheck_literals_and_operators() -> None:
+    assert check("1 + 2 * 3; true; 1 < 2 and false; not true; -4; 1 == 2") == [Int, Bool, Bool, Bool, Int, Bool]
+
+
+def test_typecheck_variables_and_blocks() -> None:
+    assert check("var x = 3; var b Bool = x > 1; { var y = x; y * 2 }") == [Unit, Unit, Int]
+
+
+def test_typecheck_if_and_while() -> None:
+    assert check("var x = 1; if x > 0 then 1 else 2; while x < 3 do { print_int(x) }") == [Unit, Int, Unit]
+
+
+def test_typecheck_rejects_mismatched_operands() -> None:
+    with pytest.raises(TypeError):
+        check("1 + true")
+    with pytest.raises(TypeError):
+        check("var x = 1; var x = 2")
+
+
+def test_typecheck_calls() -> None:
+    assert check("read_int(); print_int(read_int()); print_bool(1 < 2)") == [Int, Unit, Unit]
+    with pytest.raises(TypeError):
+        check("print_int(true)")